@@ -1,12 +1,19 @@
 __version__ = "1.0.2"
 
-from ._maldi_ms_data import Maldi_MS
-from ._database import DatabaseWindow
-from ._reader import napari_get_reader
-from ._widget import MSI_Explorer
-from ._writer import write_metadata
-from ._selection import SelectionWindow
-from ._metadata import MetadataWindow
+import importlib
+
+# The public names are imported on first access (PEP 562), so napari can
+# import the reader or widget module without loading matplotlib, scipy and
+# numba for all of them
+_LAZY_IMPORTS = {
+    "Maldi_MS": "._maldi_ms_data",
+    "DatabaseWindow": "._database",
+    "napari_get_reader": "._reader",
+    "MSI_Explorer": "._widget",
+    "write_metadata": "._writer",
+    "SelectionWindow": "._selection",
+    "MetadataWindow": "._metadata",
+}
 
 __all__ = (
     "Maldi_MS",
@@ -17,3 +24,16 @@ __all__ = (
     "SelectionWindow",
     "MetadataWindow",
 )
+
+
+def __getattr__(name):
+    if name in _LAZY_IMPORTS:
+        module = importlib.import_module(_LAZY_IMPORTS[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(__all__))
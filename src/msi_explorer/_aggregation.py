@@ -0,0 +1,327 @@
+"""
+Module for adding up the intensities of equal m/z values
+
+Imports
+-------
+numpy, numba
+
+Exports
+-------
+merge_spectra, merge_contiguous, select_spectra, sum_equal_mz, merge_sorted,
+merge_pairs
+"""
+
+import numpy as np
+from numba import jit, prange
+
+
+def merge_spectra(spectra, decimals=4):
+    """
+    Merges spectra into one spectrum, the intensities of equal (rounded) m/z
+    values are added up
+
+    Parameters
+    ----------
+    spectra : list
+        a list of sublists containing two ndarrays: m/z and intensities
+    decimals : int
+        number of decimal places the m/z values are rounded to
+
+    Returns
+    -------
+    [mz, intensities] : list of two ndarrays
+        sorted unique m/z values and the sums of their intensities
+    """
+
+    # all spectra in one array, the offsets mark the start of each spectrum
+    lengths = [len(spectrum[0]) for spectrum in spectra]
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    all_mz = np.concatenate([spectrum[0] for spectrum in spectra])
+    all_intensities = np.concatenate([spectrum[1] for spectrum in spectra])
+    return merge_contiguous(all_mz, all_intensities, offsets, decimals)
+
+
+def merge_contiguous(mz, intensities, offsets, decimals=4):
+    """
+    Merges spectra stored in contiguous arrays into one spectrum, the
+    intensities of equal (rounded) m/z values are added up
+
+    Parameters
+    ----------
+    mz : ndarray
+        m/z values of all spectra
+    intensities : ndarray
+        intensities of all spectra
+    offsets : ndarray
+        start index of each spectrum, the last entry is the total length
+    decimals : int
+        number of decimal places the m/z values are rounded to
+
+    Returns
+    -------
+    [mz, intensities] : list of two ndarrays
+        sorted unique m/z values and the sums of their intensities
+    """
+
+    all_mz = np.round(mz, decimals)
+    all_intensities = intensities
+
+    # rounding keeps the order, sorted spectra can be merged without sorting
+    if not is_sorted_piecewise(all_mz, offsets):
+        return sum_equal_mz(all_mz, all_intensities, decimals)
+
+    # merge pairs of spectra until only one is left, O(N log K) for N
+    # values in K spectra, the pairs of each round are merged in parallel.
+    # The rounds alternate between two buffers, a merged spectrum starts
+    # where its first spectrum started.
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts = offsets[:-1]
+    lengths = np.diff(offsets)
+    if len(starts) == 0:
+        return [all_mz[:0], np.empty(0, dtype=np.float64)]
+    source = (all_mz, all_intensities)
+    target = (np.empty_like(all_mz), np.empty(len(all_mz), dtype=np.float64))
+    while True:
+        # at least one round, equal m/z values within a single spectrum are
+        # added up as well
+        starts, lengths = merge_pairs(*source, starts, lengths, *target)
+        if len(starts) == 1:
+            # a copy, the buffers are as long as all spectra together
+            merged = slice(starts[0], starts[0] + lengths[0])
+            return [target[0][merged].copy(), target[1][merged].copy()]
+        if source[0] is all_mz:
+            # the rounded m/z values are a copy, they can be overwritten
+            source = (all_mz, np.empty(len(all_mz), dtype=np.float64))
+        source, target = target, source
+
+
+def select_spectra(mz, intensities, offsets, index):
+    """
+    Gathers some spectra of contiguous arrays into new contiguous arrays
+
+    Parameters
+    ----------
+    mz : ndarray
+        m/z values of all spectra
+    intensities : ndarray
+        intensities of all spectra
+    offsets : ndarray
+        start index of each spectrum, the last entry is the total length
+    index : ndarray
+        indices of the selected spectra
+
+    Returns
+    -------
+    (mz, intensities, offsets) : tuple of three ndarrays
+        the selected spectra and their offsets
+    """
+
+    index = np.asarray(index, dtype=np.int64)
+    starts = offsets[index]
+    lengths = offsets[index + 1] - starts
+    new_offsets = np.zeros(len(index) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+
+    # position of every selected value in the old arrays
+    positions = np.arange(new_offsets[-1]) + \
+        np.repeat(starts - new_offsets[:-1], lengths)
+    return mz[positions], intensities[positions], new_offsets
+
+
+def sum_equal_mz(mz, intensities, decimals=4):
+    """
+    Rounds the m/z values and adds up the intensities of equal m/z values
+
+    Parameters
+    ----------
+    mz : ndarray
+        m/z values of one or more spectra
+    intensities : ndarray
+        intensities of the m/z values
+    decimals : int
+        number of decimal places the m/z values are rounded to
+
+    Returns
+    -------
+    [mz, intensities] : list of two ndarrays
+        sorted unique m/z values and the sums of their intensities
+    """
+
+    keys = np.round(mz, decimals)
+    order = np.argsort(keys, kind="stable")
+    return list(collapse_sorted(keys[order], intensities[order]))
+
+
+@jit(nopython=True, cache=True)
+def collapse_sorted(keys, values):
+    """
+    Adds up the values of equal keys in a single pass
+
+    Parameters
+    ----------
+    keys : ndarray
+        sorted keys
+    values : ndarray
+        values belonging to the keys
+
+    Returns
+    -------
+    (new_keys, sums) : tuple of two ndarrays
+        unique keys and the sums of their values
+    """
+
+    n = len(keys)
+    new_keys = np.empty(n, dtype=keys.dtype)
+    sums = np.empty(n, dtype=np.float64)
+    if n == 0:
+        return new_keys, sums
+
+    j = 0
+    current = keys[0]
+    total = 0.0
+    for i in range(n):
+        if keys[i] != current:
+            # a new key starts, emit the sum of the previous one
+            new_keys[j] = current
+            sums[j] = total
+            j += 1
+            current = keys[i]
+            total = 0.0
+        total += values[i]
+    new_keys[j] = current
+    sums[j] = total
+
+    return new_keys[: j + 1], sums[: j + 1]
+
+
+@jit(nopython=True, cache=True)
+def is_sorted_piecewise(values, offsets):
+    """
+    Checks if every part between two offsets is sorted
+
+    Parameters
+    ----------
+    values : ndarray
+        values of all parts
+    offsets : ndarray
+        start index of each part, the last entry is the total length
+
+    Returns
+    -------
+    bool
+        True if all parts are sorted
+    """
+
+    for i in range(len(offsets) - 1):
+        for j in range(offsets[i] + 1, offsets[i + 1]):
+            if values[j] < values[j - 1]:
+                return False
+    return True
+
+
+@jit(nopython=True, cache=True)
+def merge_sorted(x1, y1, x2, y2):
+    """
+    Merges two sorted spectra in a single pass, the values of equal keys are
+    added up
+
+    Parameters
+    ----------
+    x1, x2 : ndarray
+        sorted keys (m/z values) of the two spectra
+    y1, y2 : ndarray
+        values (intensities) belonging to the keys
+
+    Returns
+    -------
+    (x, y) : tuple of two ndarrays
+        sorted unique keys and the sums of their values
+    """
+
+    n = len(x1)
+    m = len(x2)
+    x = np.empty(n + m, dtype=x1.dtype)
+    y = np.empty(n + m, dtype=np.float64)
+    i = 0
+    j = 0
+    k = 0
+    while i < n or j < m:
+        # take the smaller key of both spectra
+        if j == m or (i < n and x1[i] <= x2[j]):
+            key = x1[i]
+            value = y1[i]
+            i += 1
+        else:
+            key = x2[j]
+            value = y2[j]
+            j += 1
+        if k > 0 and x[k - 1] == key:
+            y[k - 1] += value
+        else:
+            x[k] = key
+            y[k] = value
+            k += 1
+    return x[:k], y[:k]
+
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def merge_pairs(keys, values, starts, lengths, merged_keys, merged_values):
+    """
+    Merges the sorted parts 2i and 2i + 1 in parallel, one round of
+    merge_contiguous, the values of equal keys are added up
+
+    Parameters
+    ----------
+    keys : ndarray
+        sorted keys (m/z values) of all parts
+    values : ndarray
+        values (intensities) belonging to the keys
+    starts, lengths : ndarray
+        start index and length of each part
+    merged_keys, merged_values : ndarray
+        output arrays as long as keys, a merged part is written to the start
+        of its first part
+
+    Returns
+    -------
+    (starts, lengths) : tuple of two ndarrays
+        start index and length of the merged parts, half as many as before
+        (rounded up)
+    """
+
+    num_parts = len(starts)
+    num_pairs = (num_parts + 1) // 2
+    new_starts = np.empty(num_pairs, dtype=np.int64)
+    new_lengths = np.empty(num_pairs, dtype=np.int64)
+    for p in prange(num_pairs):
+        i = starts[2 * p]
+        n = i + lengths[2 * p]
+        j = 0
+        m = 0
+        if 2 * p + 1 < num_parts:
+            j = starts[2 * p + 1]
+            m = j + lengths[2 * p + 1]
+        # the merged part is never longer than both parts together
+        start = starts[2 * p]
+        k = start
+        while i < n or j < m:
+            # take the smaller key of both parts (see merge_sorted)
+            if j == m or (i < n and keys[i] <= keys[j]):
+                key = keys[i]
+                value = values[i]
+                i += 1
+            else:
+                key = keys[j]
+                value = values[j]
+                j += 1
+            if k > start and merged_keys[k - 1] == key:
+                merged_values[k - 1] += value
+            else:
+                merged_keys[k] = key
+                merged_values[k] = value
+                k += 1
+        new_starts[p] = start
+        new_lengths[p] = k - start
+    return new_starts, new_lengths
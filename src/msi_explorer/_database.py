@@ -1,5 +1,7 @@
-import csv
+import functools
 import os
+
+import numpy as np
 from qtpy.QtWidgets import (
     QWidget,
     QVBoxLayout,
@@ -15,6 +17,37 @@ from ._writer import create_new_database, write_file
 from ._reader import select_directory
 
 
+@functools.lru_cache(maxsize=32)
+def _load_database(path, mtime):
+    """
+    Reads a database file, the result is cached per path and modification time
+
+    Parameters
+    ----------
+    path : str
+        Path of the database file
+    mtime : float
+        Modification time of the file, a changed file is read again
+
+    Returns
+    -------
+    tuple
+        Rows of the database as tuples of strings (m/z, name, description)
+    """
+    # numpy parses the whole file in C instead of row by row in Python
+    database = np.loadtxt(
+        path,
+        dtype=str,
+        delimiter=",",
+        quotechar='"',
+        usecols=(0, 1, 2),
+        ndmin=2,
+        comments=None,
+        encoding="utf-8",
+    )
+    return tuple(tuple(row) for row in database.tolist())
+
+
 class DatabaseWindow(QWidget):
     """
     A (QWidget) window to select databases from a directory and pass the
@@ -27,6 +60,8 @@ class DatabaseWindow(QWidget):
         This widget's parent widget
     buttons_widget : QWidget
         Container to hold/position the buttons at the bottom of the widget
+    database_files : list
+        Name, path and name without extension of each displayed database
 
     Methods
     -------
@@ -48,6 +83,8 @@ class DatabaseWindow(QWidget):
             This widget's parent widget
         """
         super().__init__()
+        # lay out all widgets in a single pass at the end of __init__
+        self.setUpdatesEnabled(False)
         self.setLayout(QVBoxLayout())
 
         self.parent = parent
@@ -103,11 +140,13 @@ class DatabaseWindow(QWidget):
         self.scrollarea.setWidget(self.groupbox_data)
         self.layout().addWidget(self.scrollarea)
         self._read_database_files()
+        self.setUpdatesEnabled(True)
 
     def _read_database_files(self):
         """
         Reads database files, re-displays all databases for selection
         """
+        self.setUpdatesEnabled(False)
         new_data = QGroupBox()
         new_data.setLayout(QVBoxLayout())
         new_data.layout().addWidget(self.label_database)
@@ -116,20 +155,27 @@ class DatabaseWindow(QWidget):
             self.hidden_databases = f.readlines()
 
         self.checkboxes = []
-        for file in os.listdir(self.db_directory):
-            if not file.endswith(".csv"):
-                continue
-            print(f"found {file}")
-            if f"{file}\n" in self.hidden_databases:
-                print(f"skipping {file}")
-                continue
-            checkbox = QCheckBox(os.path.splitext(file)[0])
-            self.checkboxes.append(checkbox)
-            new_data.layout().addWidget(checkbox)
+        # name, path and name without extension of the displayed databases
+        self.database_files = []
+        with os.scandir(self.db_directory) as entries:
+            for entry in entries:
+                file = entry.name
+                if not file.endswith(".csv"):
+                    continue
+                print(f"found {file}")
+                if f"{file}\n" in self.hidden_databases:
+                    print(f"skipping {file}")
+                    continue
+                stem = os.path.splitext(file)[0]
+                self.database_files.append((file, entry.path, stem))
+                checkbox = QCheckBox(stem)
+                self.checkboxes.append(checkbox)
+                new_data.layout().addWidget(checkbox)
         
         new_data.layout().addWidget(self.buttons_widget)
         self.scrollarea.setWidget(new_data)
         self.groupbox_data = new_data
+        self.setUpdatesEnabled(True)
 
     def _add_database(self):
         """
@@ -165,30 +211,25 @@ class DatabaseWindow(QWidget):
         Reads data from selected databases, sets data in parent widget and triggers update
         """
         metabolites = {}
-        key_list = []
-        for i in range(len(self.checkboxes)):
-            if self.checkboxes[i].isChecked():
-                with open(
-                    self.db_directory
-                    + self.checkboxes[i].text()
-                    + ".csv",
-                    newline="",
-                ) as csvfile:
-                    database_reader = csv.reader(
-                        csvfile, delimiter=",", quotechar='"'
-                    )
-                    for row in database_reader:
-                        # handle pontential m/z collision
-                        if not row[0] in key_list:
-                            metabolites[row[0]] = [(row[1], row[2])]
-                            key_list.append(row[0])
-                        else:
-                            if (row[1], row[2]) not in metabolites[row[0]]:
-                                metabolites[row[0]].append((row[1], row[2]))
-
-        key_list = sorted(key_list, key=float)
-        metabolites_sorted = {key: metabolites[key] for key in key_list}
+        for checkbox, (_, path, _) in zip(self.checkboxes, self.database_files):
+            if not checkbox.isChecked():
+                continue
+            database = _load_database(path, os.path.getmtime(path))
+            for mz, name, description in database:
+                # handle pontential m/z collision, the dict lookup replaces
+                # a linear search through a list of all m/z values
+                entries = metabolites.setdefault(mz, [])
+                if (name, description) not in entries:
+                    entries.append((name, description))
+
+        # sort the m/z values numerically, the parent also gets them as
+        # an array in the same order as the keys of the dict
+        key_list = list(metabolites)
+        mzs = np.array(key_list, dtype=np.float64)
+        order = np.argsort(mzs, kind="stable")
+        metabolites_sorted = {key_list[i]: metabolites[key_list[i]] for i in order}
         self.parent.metabolites = metabolites_sorted
+        self.parent.metabolite_mzs = mzs[order]
         self.parent.modified_metabolites = self.parent.metabolites
         self.parent.update_mzs()
         self.close()
@@ -4,11 +4,11 @@ Module for the definition of the class Maldi_MS
 Imports
 -------
 copy, numpy, scipy, matplotlib.pyplot, json, os, pyimzml.ImzMLParser, time,
-numba
+collections, concurrent.futures, numba
 
 Exports
 -------
-Maldi_MS
+Maldi_MS, envelope
 """
 
 # Copyright © Peter Lampen, ISAS Dortmund, 2023, 2024
@@ -20,9 +20,35 @@ from scipy import integrate
 import matplotlib.pyplot as plt
 import json
 import os
-from pyimzml.ImzMLParser import ImzMLParser, getionimage, _bisect_spectrum
+from pyimzml.ImzMLParser import ImzMLParser, _bisect_spectrum
 import time
-from numba import jit
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from numba import jit, prange
+
+# number of spectra read by one worker thread
+READ_BATCH_SIZE = 100
+
+# number of ion images kept by get_ion_image
+ION_CACHE_SIZE = 32
+
+# plot_spectrum reduces longer profile spectra to the envelope of PLOT_BUCKETS
+# buckets
+PLOT_BUCKETS = 5000
+
+# normalization methods as integers for the numba kernels
+_NORM_KIND = {'tic': 0, 'rms': 1, 'median': 2, 'peak': 3}
+
+# key paths of the selected metadata, the first path found is used
+_METADATA_PATHS = (
+    ('name', (
+        ('file_description', 'source_files', 'sf1', 'name'),
+        ('file_description', 'source_files', 'SF1', 'name'))),
+    ('filter string', (
+        ('referenceable_param_groups', 'scan1', 'filter string'),)),
+    ('noise level', (
+        ('referenceable_param_groups', 'spectrum1', 'noise level'),)),
+)
 
 class Maldi_MS():
     """
@@ -33,15 +59,28 @@ class Maldi_MS():
     p : class ImzMLParser
         This is the result of the method ImzMLParser('NN.imzML')
     spectra : list
-        A list of sublists containing two ndarrays: m/z and intensities
+        A list of sublists containing two ndarrays: m/z and intensities,
+        views into _mz_data and _int_data
+    _mz_data, _int_data : ndarray
+        m/z values and intensities (float32) of all spectra in contiguous
+        arrays
+    _offsets : ndarray
+        start index of each spectrum in _mz_data and _int_data, the last
+        entry is the total length
     new_spectra : list
         A list of sublists containing processed spectra
     is_norm : boolean
         are there normalized spectra?
     is_centroid : boolean
         are there centroid data
+    is_filtered : boolean
+        were the intensities changed by noise_reduction or remove_hotspots?
+    filename : str
+        path of the imzML file
     coordinates : list
         A list of tuples containing the coordinates (x, y, z)
+    _xs, _ys, _zs : ndarray
+        coordinates x, y and z of all spectra as int32 arrays
     metadata : dict
         A nested dictionary with the metadata of the measurement
     num_spectra : int
@@ -61,10 +100,17 @@ class Maldi_MS():
         get the coordinates (x, y, 1) of spectrum[i]
     get_spectrum(i: int)
         get a list with m/z and intensities of spectrum[i]
+    get_spectrum_unchecked(i: int)
+        get_spectrum for an index known to be valid
     get_all_spectra()
         get a list of sublists with all spectra
+    get_contiguous_spectra()
+        get the current spectra as contiguous arrays and their offsets
+    get_tic()
+        get the total ion current of every original spectrum
     plot_spectrum(i: int, fmt : str)
-        plot spectrum[i] with matplotlib.pyplot
+        plot spectrum[i] with matplotlib.pyplot, long profile spectra are
+        reduced to their envelope (see envelope)
     get_ion_image(mz: float, tol: float)
         get a 2D ndarray with an ion image at m/z +/- tol
     plot_ion_image(image: ndarray)
@@ -105,20 +151,116 @@ class Maldi_MS():
 
         parser = ImzMLParser(filename)
         self.p = parser
+        self.filename = filename
         self.spectra = []           # empty list
         self.new_spectra = []
-        self.coordinates = []
+        self._new_int_data = None   # intensities of the normalized spectra
+        self._coordinates = None    # built by the property coordinates
         self.is_norm = False
         self.is_centroid = False
+        self.is_filtered = False    # noise reduction or hotspot removal
         self.norm_type = 'original' # Lennart
 
-        for i, (x, y, z) in enumerate(parser.coordinates):
-            mz, intensities = parser.getspectrum(i)
-            self.spectra.append([mz, intensities])      # list of sublists
-            self.coordinates.append((x, y, z))          # list of tuples
+        # All spectra are stored in two contiguous arrays (m/z and
+        # intensities), the offsets mark the start of each spectrum.
+        # self.spectra holds views into these arrays. The intensities are
+        # stored as float32 whatever the precision in the file is, this
+        # halves the memory of float64 data.
+        lengths = np.asarray(parser.mzLengths, dtype=np.int64)
+        if not np.array_equal(lengths, parser.intensityLengths):
+            raise ValueError('m/z and intensity arrays differ in length')
+        self._offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self._offsets[1:])
+        self._mz_data = np.empty(self._offsets[-1], dtype=parser.mzPrecision)
+        self._int_data = np.empty(self._offsets[-1], dtype=np.float32)
+
+        self._read_spectra(parser)
+
+        for i in range(len(lengths)):
+            start, end = self._offsets[i], self._offsets[i + 1]
+            self.spectra.append([self._mz_data[start:end], \
+                self._int_data[start:end]])             # list of sublists
+
+        # coordinates x, y and z as three contiguous arrays
+        self._xs, self._ys, self._zs = np.array(parser.coordinates, \
+            dtype=np.int32).reshape(-1, 3).T.copy()
+
+        # index of the (first) spectrum at each coordinate for get_index
+        self._coordinate_index = {}
+        for i, coordinate in enumerate(zip(self._xs.tolist(), \
+            self._ys.tolist(), self._zs.tolist())):
+            self._coordinate_index.setdefault(coordinate, i)
 
         self.metadata = parser.metadata.pretty()        # nested dictionary
-        self.num_spectra = len(self.coordinates)        # number of spectra
+        self._metadata_json = None          # cached by get_metadata_json
+        self._metadata_selected = None      # cached by get_metadata
+        self._ion_cache = OrderedDict()     # cached by get_ion_image
+        self._tic = None                    # cached by get_tic
+        self.num_spectra = len(self._xs)                # number of spectra
+
+    @property
+    def coordinates(self):
+        """
+        list of tuples with the coordinates (x, y, z) of all spectra, built
+        on first use from the arrays _xs, _ys and _zs
+        """
+
+        if self._coordinates is None:
+            self._coordinates = list(zip(self._xs.tolist(), \
+                self._ys.tolist(), self._zs.tolist()))
+        return self._coordinates
+
+    def _read_spectra(self, parser):
+        """
+        read all spectra from the binary file into _mz_data and _int_data
+
+        Parameter
+        ---------
+        parser : class ImzMLParser
+            parser of the opened imzML file
+        """
+
+        num_spectra = len(self._offsets) - 1
+        if not hasattr(os, 'pread'):
+            # no positional reads (Windows), the parser reads one by one
+            for i in range(num_spectra):
+                start, end = self._offsets[i], self._offsets[i + 1]
+                mz, intensities = parser.getspectrum(i)
+                self._mz_data[start:end] = mz
+                self._int_data[start:end] = intensities
+            return
+
+        # os.pread doesn't move the shared file position and releases the
+        # GIL, so batches of spectra can be read by several threads
+        fd = parser.m.fileno()
+        mz_dtype = np.dtype(parser.mzPrecision)
+        int_dtype = np.dtype(parser.intensityPrecision)
+
+        def read_into(target, dtype, offset):
+            nbytes = len(target) * dtype.itemsize
+            if target.dtype == dtype and hasattr(os, 'preadv'):
+                # read straight into the array, no temporary bytes object
+                count = os.preadv(fd, [target], offset)
+            else:
+                buffer = os.pread(fd, nbytes, offset)
+                count = len(buffer)
+                if count == nbytes:
+                    target[:] = np.frombuffer(buffer, dtype=dtype)
+            if count != nbytes:
+                raise ValueError('The binary file is too short')
+
+        def read_batch(first):
+            for i in range(first, min(first + READ_BATCH_SIZE, num_spectra)):
+                start, end = self._offsets[i], self._offsets[i + 1]
+                read_into(self._mz_data[start:end], mz_dtype, \
+                    parser.mzOffsets[i])
+                read_into(self._int_data[start:end], int_dtype, \
+                    parser.intensityOffsets[i])
+
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            # list() re-raises the first error of a worker
+            list(executor.map(read_batch, \
+                range(0, num_spectra, READ_BATCH_SIZE)))
 
     def check_i(self, i: int):
         """
@@ -137,6 +279,10 @@ class Maldi_MS():
             num_spectra-1 if i >= num_spectra
         """
 
+        # fast path for valid indices
+        if type(i) is int and 0 <= i < self.num_spectra:
+            return i
+
         try:
             i = int(i)
         except BaseException as err:
@@ -181,10 +327,7 @@ class Maldi_MS():
 
         # Find the index (i) of a mass spectrum at the position (x, y, 1).
         # (21.02.2023)
-        try:
-            return self.coordinates.index((x, y, 1))
-        except BaseException:
-            return -1
+        return self._coordinate_index.get((x, y, 1), -1)
 
     def get_coordinates(self, i: int):
         """
@@ -203,7 +346,7 @@ class Maldi_MS():
         """
 
         i = self.check_i(i)
-        return self.coordinates[i]
+        return (int(self._xs[i]), int(self._ys[i]), int(self._zs[i]))
 
     def get_spectrum(self, i: int):
         """
@@ -220,7 +363,23 @@ class Maldi_MS():
             A list of two ndarrays: m/z and intensities for spectrum[i]
         """
 
-        i = self.check_i(i)
+        return self.get_spectrum_unchecked(self.check_i(i))
+
+    def get_spectrum_unchecked(self, i: int):
+        """
+        get_spectrum without the check of the index, for callers whose index
+        is known to be valid (e.g. from get_index)
+
+        Parameter
+        ---------
+        i : int
+            index of spectrum[i], 0 <= i < num_spectra
+
+        Returns
+        -------
+        list
+            A list of two ndarrays: m/z and intensities for spectrum[i]
+        """
 
         if self.is_norm or self.is_centroid:
             return self.new_spectra[i]
@@ -243,6 +402,32 @@ class Maldi_MS():
         else:
             return self.spectra
 
+    def get_tic(self):
+        """
+        get the total ion current (sum of the intensities) of every original
+        spectrum
+
+        Returns
+        -------
+        ndarray
+            the total ion current of each spectrum
+        """
+
+        if self._tic is not None:
+            return self._tic.copy()
+
+        # one pass over the contiguous intensities instead of one sum per
+        # spectrum; reduceat returns a single element for empty spectra
+        starts = self._offsets[:-1]
+        lengths = np.diff(self._offsets)
+        tic = np.zeros(self.num_spectra, dtype=np.float64)
+        nonempty = lengths > 0
+        if np.any(nonempty):
+            tic[nonempty] = np.add.reduceat(self._int_data, \
+                starts[nonempty], dtype=np.float64)
+        self._tic = tic
+        return tic.copy()
+
     def plot_spectrum(self, i: int = 0, fmt: str = '-'):
         """
         plot spectrum[i] with matplotlib.pyplot
@@ -265,6 +450,7 @@ class Maldi_MS():
         if self.is_centroid:
             ax.stem(mz, intensities, markerfmt='none')
         else:
+            mz, intensities = envelope(mz, intensities, PLOT_BUCKETS)
             ax.plot(mz, intensities, fmt)
 
         coord = self.get_coordinates(i)
@@ -290,13 +476,58 @@ class Maldi_MS():
         """
 
         # (10.02.2023)
-        try:
-            if self.is_norm or self.is_centroid:
-                return self.getionimage_new(self.p, mz, tol)
-            else:
-                return getionimage(self.p, mz, tol)
-        except IndexError as exc:
-            raise RuntimeError("Error: metadata is incorrect") from exc
+        tol = abs(tol)
+        # the exact values, ranges differing only in the last digits give
+        # different images
+        key = (float(mz), float(tol))
+        if key in self._ion_cache:
+            self._ion_cache.move_to_end(key)
+            return self._ion_cache[key].copy()
+
+        height = self.p.imzmldict["max count of pixels y"]
+        width = self.p.imzmldict["max count of pixels x"]
+
+        # the kernel doesn't check the bounds of the image
+        mask = self._zs == 1
+        xs, ys = self._xs[mask], self._ys[mask]
+        if len(xs) and (xs.min() < 1 or xs.max() > width or \
+            ys.min() < 1 or ys.max() > height):
+            raise RuntimeError("Error: metadata is incorrect")
+
+        mz_data, int_data, offsets = self.get_contiguous_spectra()
+        image = np.zeros((height, width))
+        ion_image(mz_data, int_data, offsets, self._xs, self._ys, self._zs, \
+            1, mz - tol, mz + tol, image)
+
+        self._ion_cache[key] = image
+        if len(self._ion_cache) > ION_CACHE_SIZE:
+            self._ion_cache.popitem(last=False)     # least recently used
+        return image.copy()
+
+    def get_contiguous_spectra(self):
+        """
+        get the current spectra (see get_all_spectra) as contiguous arrays
+
+        Returns
+        -------
+        (mz, intensities, offsets) : tuple of three ndarrays
+            m/z values and intensities of all spectra and the start index of
+            each spectrum, the last entry is the total length
+        """
+
+        if self.is_centroid:
+            # the centroid spectra are separate arrays of different lengths
+            lengths = [len(spectrum[0]) for spectrum in self.new_spectra]
+            offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            mz = np.concatenate([spectrum[0] for spectrum in self.new_spectra])
+            intensities = np.concatenate( \
+                [spectrum[1] for spectrum in self.new_spectra])
+            return mz, intensities, offsets
+        elif self.is_norm:
+            return self._mz_data, self._new_int_data, self._offsets
+        else:
+            return self._mz_data, self._int_data, self._offsets
 
     def plot_ion_image(self, image, mz: float):
         """
@@ -326,7 +557,11 @@ class Maldi_MS():
             all metadata as a string in JSON format
         """
 
-        return json.dumps(self.metadata, sort_keys=False, indent=4)
+        # the metadata don't change, the string is created only once
+        if self._metadata_json is None:
+            self._metadata_json = json.dumps(self.metadata, sort_keys=False, \
+                indent=4)
+        return self._metadata_json
 
     def get_metadata(self):
         """
@@ -341,57 +576,57 @@ class Maldi_MS():
         # Read the dictionary p.metadata.pretty() to extract some metadata.
         # (23.02.2023)
 
+        # the metadata don't change, they are extracted only once; callers
+        # get a copy they may change
+        if self._metadata_selected is None:
+            self._metadata_selected = self._select_metadata()
+        return dict(self._metadata_selected)
+
+    def _select_metadata(self):
+        """
+        extract the selected metadata from the nested dictionary
+
+        Returns
+        -------
+        dict
+            dictionary with selected metadata
+        """
+
         meta = self.metadata
         d = dict()
 
-        if 'sf1' in meta['file_description']['source_files'].keys():
-            d['name'] = meta['file_description']['source_files']['sf1']['name']
-        elif 'SF1' in meta['file_description']['source_files'].keys():
-            d['name'] = meta['file_description']['source_files']['SF1']['name']
-        
-        if 'scan1' in meta['referenceable_param_groups'].keys():
-            d['filter string'] = \
-                meta['referenceable_param_groups']['scan1']['filter string']
-                
-        if 'spectrum1' in meta['referenceable_param_groups'].keys() \
-            and 'noise level' in meta['referenceable_param_groups']['spectrum1'].keys():
-            d['noise level'] = \
-                meta['referenceable_param_groups']['spectrum1']['noise level']
-        
-        if 'samples' in meta.keys():
-            sample_keys = list(meta['samples'].keys())
+        for name, paths in _METADATA_PATHS:
+            for path in paths:
+                value = _dig(meta, *path)
+                if value is not None:
+                    d[name] = value
+                    break
+
+        samples = _dig(meta, 'samples')
+        if samples is not None:
+            sample_keys = list(samples.keys())
             if len(sample_keys) == 1:
                 d['samples'] = sample_keys[0]
             else:
                 d['samples'] = sample_keys
 
-
         d['max count x'] = self.p.imzmldict["max count of pixels x"]
         d['max count y'] = self.p.imzmldict["max count of pixels y"]
-        if 'scansettings1' in meta['scan_settings'].keys():
-            d['pixel size x'] = \
-                meta['scan_settings']['scansettings1']['pixel size (x)']
-            d['pixel size y'] = \
-                meta['scan_settings']['scansettings1']['pixel size y']
-            print("case 1!")
-        elif 'scanSettings0' in meta['scan_settings'].keys():
-            d['pixel size x'] = \
-                meta['scan_settings']['scanSettings0']['pixel size (x)']
-            d['pixel size y'] = \
-                meta['scan_settings']['scanSettings0']['pixel size y']
-            print("case 2!")
-        elif 'scan1' in meta['scan_settings'].keys():
-            d['pixel size x'] = \
-                meta['scan_settings']['scan1']['pixel size (x)']
-            d['pixel size y'] = \
-                meta['scan_settings']['scan1']['pixel size (x)']
-            print("case 3!")
-        elif 'scansetting1' in meta['scan_settings'].keys():
-            d['pixel size x'] = \
-                meta['scan_settings']['scansetting1']['pixel size (x)']
-            d['pixel size y'] = \
-                meta['scan_settings']['scansetting1']['pixel size y']
-            print("case 4!")
+
+        # the name of the scan settings differs between the files, 'scan1'
+        # has no pixel size y
+        settings_keys = [('scansettings1', 'pixel size y'),
+            ('scanSettings0', 'pixel size y'),
+            ('scan1', 'pixel size (x)'),
+            ('scansetting1', 'pixel size y')]
+        for case, (settings, key_y) in enumerate(settings_keys, start=1):
+            if _dig(meta, 'scan_settings', settings) is not None:
+                d['pixel size x'] = _dig(meta, 'scan_settings', settings, \
+                    'pixel size (x)')
+                d['pixel size y'] = _dig(meta, 'scan_settings', settings, \
+                    key_y)
+                print("case %d!" % case)
+                break
 
         return d
 
@@ -409,72 +644,31 @@ class Maldi_MS():
             tolerance of the m/z value in Da
         """
         # (18.07.2023)
+        self._ion_cache.clear()
         self.new_spectra = []
         self.norm_type = norm       # Lennart
         if norm == 'original':      # Lennart
             self.is_norm = False
-        elif norm == 'tic':               # Total ion current = Mean
-            for spectrum in self.spectra:
-                mz = spectrum[0]
-                intensities = np.copy(spectrum[1])
-
-                filter = intensities != 0.0
-                intensities2 = intensities[filter]
-                tic = np.mean(intensities2)
-
-                intensities /= tic
-                self.new_spectra.append([mz, intensities])
-            self.is_norm = True
-        elif norm == 'rms':               # Root mean square = Vector norm
-            for spectrum in self.spectra:
-                mz = spectrum[0]
-                intensities = np.copy(spectrum[1])
-
-                filter = intensities != 0.0
-                intensities2 = intensities[filter]
-                square1 = np.square(intensities2)
-                mean1 = np.mean(square1)
-                rms = np.sqrt(mean1)
-
-                intensities /= rms
-                self.new_spectra.append([mz, intensities])
-            self.is_norm = True
-        elif norm == 'median':
-            for spectrum in self.spectra:
-                mz = spectrum[0]
-                intensities = np.copy(spectrum[1])
-
-                filter = intensities != 0.0
-                intensities2 = intensities[filter]
-                median1 = np.median(intensities2)
-
-                intensities /= median1
-                self.new_spectra.append([mz, intensities])
-            self.is_norm = True
-        elif norm == 'peak':
-            for spectrum in self.spectra:
-                mz = spectrum[0]
-                intensities = np.copy(spectrum[1])
-
-                # First step: define an interval on the abscissa
-                filter1 = mz >= (mz0 - tol)
-                filter2 = mz <= (mz0 + tol)
-                filter3 = np.logical_and(filter1, filter2)
-
-                # Second step: calculate a factor for normalization
-                if np.any(filter3):         # peak found
-                    maximum = intensities[filter3].max()
-                    if maximum > 0.0:
-                        factor = 100.0 / maximum
-                    else:                   # only zeros found
-                        factor = 0.0
-                else:                       # nothing found
-                    factor = 0.0
-
-                # Third step: normalize the spectrum
-                intensities *= factor
-                self.new_spectra.append([mz, intensities])
-            self.is_norm = True
+            return
+        kind = _NORM_KIND[norm]
+
+        # the kernels work on the contiguous arrays of all spectra
+        offsets = self._offsets
+        intensities = self._int_data
+        mz = self._mz_data
+
+        # tic, rms and median are divisors, peak is a factor
+        factors = normalization_factors(mz, intensities, offsets, kind, \
+            mz0, tol).astype(intensities.dtype)
+        new_intensities = scale_spectra(intensities, offsets, factors, \
+            kind != _NORM_KIND['peak'])
+        self._new_int_data = new_intensities
+
+        for i, spectrum in enumerate(self.spectra):
+            self.new_spectra.append(
+                [spectrum[0], new_intensities[offsets[i]:offsets[i + 1]]])
+        self.is_norm = True
+        if kind == _NORM_KIND['peak']:
             self.norm_type += f" {mz0}"
 
     def getionimage_new(self, p, mz_value, tol=0.1, z=1, reduce_func=sum):
@@ -510,7 +704,8 @@ class Maldi_MS():
             if z_ == 0:
                 UserWarning("z coordinate = 0 present, if you're getting blank images set getionimage(.., .., z=0)")
             if z_ == z:
-                mzs, ints = map(lambda x: np.asarray(x), self.get_spectrum(i))
+                mzs, ints = map(lambda x: np.asarray(x), \
+                    self.get_spectrum_unchecked(i))
                 min_i, max_i = _bisect_spectrum(mzs, mz_value, tol)
                 im[y - 1, x - 1] = reduce_func(ints[min_i:max_i+1])
         return im
@@ -565,18 +760,21 @@ class Maldi_MS():
 
         limit = self.get_percentile(percentage)
         print('Noise reduction: limit =', limit)
+        self._ion_cache.clear()
+        self._tic = None        # the original intensities may change
+        self.is_filtered = True
 
+        # the intensities are changed in place, for the original spectra
+        # this also changes the contiguous array self._int_data
         n = len(spectra)
         for i in range(n):
-            intens0 = spectra[i][1]
-            intensities = np.copy(intens0)
+            intensities = spectra[i][1]
 
             # search for peaks < limit
             filter1 = intensities != 0.0
             filter2 = intensities < limit
             filter3 = np.logical_and(filter1, filter2)
             intensities[filter3] = 0.0
-            spectra[i][1] = intensities
 
     def remove_hotspots(self, percentage: float = 99.0):
         """
@@ -591,16 +789,18 @@ class Maldi_MS():
 
         limit = self.get_percentile(percentage)
         print('Hotspot removal: limit =', limit)
+        self._ion_cache.clear()
+        self._tic = None        # the original intensities may change
+        self.is_filtered = True
 
+        # the intensities are changed in place (see noise_reduction)
         n = len(spectra)
         for i in range(n):
-            intens0 = spectra[i][1]
-            intensities = np.copy(intens0)
+            intensities = spectra[i][1]
 
             # search for hotspots
             filter = intensities > limit
             intensities[filter] = limit
-            spectra[i][1] = intensities
 
         """
         intensities = [ d[1] for d in spectra ]
@@ -645,6 +845,7 @@ class Maldi_MS():
 
         # (26.09.2023)
         start_time1 = time.time()       # start time
+        self._ion_cache.clear()
 
         if self.is_norm:
             old_spectra = copy.deepcopy(self.new_spectra)
@@ -679,7 +880,68 @@ class Maldi_MS():
             % (stop_time1 - start_time1, self.num_spectra))
 
 
-@jit(nopython=True)
+def envelope(mz, intensities, num_buckets):
+    """
+    downsample a spectrum to the minimum and maximum intensity of buckets of
+    consecutive points, the plotted envelope looks like the full spectrum
+
+    Parameters
+    ----------
+    mz : ndarray
+        sorted m/z values
+    intensities : ndarray
+        intensities of the m/z values
+    num_buckets : int
+        number of buckets
+
+    Returns
+    -------
+    (mz, intensities) : tuple of two ndarrays
+        m/z values and intensities with two points per bucket, the spectrum
+        itself if it isn't longer than that
+    """
+
+    if len(mz) <= 2 * num_buckets:
+        return mz, intensities
+    starts = np.linspace(0, len(mz), num_buckets + 1).astype(np.int64)
+    ends = starts[1:] - 1
+    starts = starts[:-1]
+    # minimum at the start and maximum at the end of each bucket
+    new_mz = np.column_stack((mz[starts], mz[ends])).ravel()
+    new_intensities = np.column_stack((
+        np.minimum.reduceat(intensities, starts),
+        np.maximum.reduceat(intensities, starts),
+    )).ravel()
+    return new_mz, new_intensities
+
+
+def _dig(d, *keys):
+    """
+    walk a path of keys through nested dictionaries
+
+    Parameters
+    ----------
+    d : dict
+        nested dictionary
+    keys : str
+        the keys of the path
+
+    Returns
+    -------
+    object
+        the value at the end of the path, None if a key is missing
+    """
+
+    for key in keys:
+        if not isinstance(d, dict):
+            return None
+        d = d.get(key)
+        if d is None:
+            return None
+    return d
+
+
+@jit(nopython=True, cache=True)
 def centroid_numba(mz, intensities, quadrature, start_indices, end_indices):
     """
     Calculate one centroid spectrum
@@ -723,3 +985,138 @@ def centroid_numba(mz, intensities, quadrature, start_indices, end_indices):
         new_intensities[i] = quadrature[end] - quadrature[start]
 
     return [new_mz, new_intensities]
+
+
+@jit(nopython=True, parallel=True, error_model='numpy', cache=True)
+def normalization_factors(mz, intensities, offsets, kind, mz0, tol):
+    """
+    Calculate the normalization factor of every spectrum
+
+    Parameters
+    ----------
+    mz : ndarray
+        m/z values of all spectra (only used for 'peak')
+    intensities : ndarray
+        intensities of all spectra
+    offsets : ndarray
+        start index of each spectrum, the last entry is the total length
+    kind : int
+        0: tic, 1: rms, 2: median, 3: peak
+    mz0 : float
+        m/z value of the reference peak in Da
+    tol : float
+        tolerance of the m/z value in Da
+
+    Returns
+    -------
+    factors : ndarray
+        divisors (tic, rms, median) or factors (peak) of the spectra
+    """
+
+    n = len(offsets) - 1
+    factors = np.zeros(n)
+    for i in prange(n):
+        start = offsets[i]
+        end = offsets[i + 1]
+        if kind == 3:               # peak
+            maximum = -1.0
+            for j in range(start, end):
+                if mz[j] >= mz0 - tol and mz[j] <= mz0 + tol:
+                    maximum = max(maximum, intensities[j])
+            if maximum > 0.0:
+                factors[i] = 100.0 / maximum
+            else:                   # nothing or only zeros found
+                factors[i] = 0.0
+        elif kind == 2:             # median of the intensities != 0
+            nonzero = intensities[start:end]
+            nonzero = nonzero[nonzero != 0.0]
+            if len(nonzero) > 0:
+                factors[i] = np.median(nonzero)
+            else:
+                factors[i] = np.nan
+        else:                       # mean or root mean square
+            total = 0.0
+            count = 0
+            for j in range(start, end):
+                value = intensities[j]
+                if value != 0.0:
+                    if kind == 0:
+                        total += value
+                    else:
+                        total += value * value
+                    count += 1
+            mean = total / count
+            if kind == 0:
+                factors[i] = mean
+            else:
+                factors[i] = np.sqrt(mean)
+    return factors
+
+
+@jit(nopython=True, parallel=True, error_model='numpy', cache=True)
+def scale_spectra(intensities, offsets, factors, divide):
+    """
+    Divide or multiply every spectrum by its factor
+
+    Parameters
+    ----------
+    intensities : ndarray
+        intensities of all spectra
+    offsets : ndarray
+        start index of each spectrum, the last entry is the total length
+    factors : ndarray
+        one factor per spectrum, same dtype as the intensities
+    divide : bool
+        True: divide by the factors, False: multiply
+
+    Returns
+    -------
+    new_intensities : ndarray
+        scaled intensities of all spectra
+    """
+
+    new_intensities = np.empty_like(intensities)
+    for i in prange(len(offsets) - 1):
+        factor = factors[i]
+        for j in range(offsets[i], offsets[i + 1]):
+            if divide:
+                new_intensities[j] = intensities[j] / factor
+            else:
+                new_intensities[j] = intensities[j] * factor
+    return new_intensities
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def ion_image(mz, intensities, offsets, xs, ys, zs, z, mz_lo, mz_hi, out):
+    """
+    Sum up the intensities of every spectrum in the interval [mz_lo, mz_hi]
+
+    Parameters
+    ----------
+    mz : ndarray
+        m/z values of all spectra, sorted within each spectrum
+    intensities : ndarray
+        intensities of all spectra
+    offsets : ndarray
+        start index of each spectrum, the last entry is the total length
+    xs, ys, zs : ndarray
+        coordinates of the spectra, starting at 1
+    z : int
+        only spectra with this z coordinate are used
+    mz_lo, mz_hi : float
+        limits of the m/z interval
+    out : ndarray
+        2D ion image, out[y-1, x-1] is set for every spectrum
+    """
+
+    for i in prange(len(offsets) - 1):
+        if zs[i] != z:
+            continue
+        start = offsets[i]
+        end = offsets[i + 1]
+        lo = start + np.searchsorted(mz[start:end], mz_lo, side='left')
+        hi = start + np.searchsorted(mz[start:end], mz_hi, side='right')
+        total = 0.0
+        for j in range(lo, hi):
+            total += intensities[j]
+        out[ys[i] - 1, xs[i] - 1] = total
@@ -16,8 +16,14 @@ class MetadataWindow(QWidget):
 
     Attributes
     ----------
+    ms_object : Maldi_MS
+        Maldi_MS object whose metadata are displayed
     data_frame : QFrame
         Container to hold the key/value pairs
+    rows : list
+        The key/value widgets of all lines of [data_frame]
+    empty_lines : set
+        Indices (in [rows]) of the manual lines with blank key and value
 
     Methods
     -------
@@ -27,8 +33,8 @@ class MetadataWindow(QWidget):
         Compiles metadata from all lines and returns it
     add_line()
         Adds an empty line at the bottom
-    check_for_empty_line()
-        Checks if last line is empty
+    check_for_empty_line(line)
+        Updates the empty state of a line, adds a line if none is empty
     """
 
     def __init__(self, ms_object, parent):
@@ -43,6 +49,7 @@ class MetadataWindow(QWidget):
         super().__init__()
         self.setLayout(QVBoxLayout())
         self.parent = parent
+        self.ms_object = ms_object
 
         ### QObjects
         # Label
@@ -63,11 +70,13 @@ class MetadataWindow(QWidget):
         self.data_frame.setCellWidget(0, 0, label_key)
         self.data_frame.setCellWidget(0, 1, label_value)
         self.row_index = 1
+        self.rows = [(label_key, label_value)]
+        self.empty_lines = set()
 
-        if not hasattr(parent, "metadata"):
+        # the parent holds the metadata once they have been saved
+        metadata = getattr(parent, "metadata", None)
+        if metadata is None:
             metadata = ms_object.get_metadata()
-        else:
-            metadata = parent.metadata
 
         for key in metadata:
             key_label = QLabel(key)
@@ -76,12 +85,12 @@ class MetadataWindow(QWidget):
             self.data_frame.setRowCount(self.data_frame.rowCount() + 1)
             self.data_frame.setCellWidget(self.row_index, 0, key_label)
             self.data_frame.setCellWidget(self.row_index, 1, value_label)
+            self.rows.append((key_label, value_label))
             self.row_index += 1
 
         self.layout().addWidget(self.data_frame)
         self.layout().addWidget(btn_save)
         self.layout().addWidget(btn_export)
-        self.first_manual_row = self.row_index
 
         self._add_line()
 
@@ -91,7 +100,7 @@ class MetadataWindow(QWidget):
         Calls metadata writer with [filepath] and [metadata]
         """
         metadata = self._compile_metadata()
-        filepath = save_dialog(self, "*.csv")[0]
+        filepath = save_dialog(self, "*.csv")
         try:
             write_metadata(filepath, metadata)
         except FileNotFoundError:
@@ -107,9 +116,9 @@ class MetadataWindow(QWidget):
             A list of tuples that holds key/value pairs of metadata
         """
         metadata = []
-        for row in range(self.data_frame.rowCount()):
-            key = self.data_frame.cellWidget(row, 0).text()
-            value = self.data_frame.cellWidget(row, 1).text()
+        for key_widget, value_widget in self.rows:
+            key = key_widget.text()
+            value = value_widget.text()
             if key == "" or value == "":
                 continue
             metadata.append((key, value))
@@ -133,19 +142,29 @@ class MetadataWindow(QWidget):
         self.data_frame.setRowCount(self.data_frame.rowCount() + 1)
         self.data_frame.setCellWidget(self.row_index, 0, key)
         self.data_frame.setCellWidget(self.row_index, 1, value)
+        self.rows.append((key, value))
         self.row_index += 1
 
-        key.textChanged.connect(self._check_for_empty_line)
-        value.textChanged.connect(self._check_for_empty_line)
+        # only the edited line is checked, the others keep their state
+        line = len(self.rows) - 1
+        self.empty_lines.add(line)
+        key.textChanged.connect(lambda _, line=line: self._check_for_empty_line(line))
+        value.textChanged.connect(lambda _, line=line: self._check_for_empty_line(line))
 
-    def _check_for_empty_line(self):
+    def _check_for_empty_line(self, line):
         """
-        Checks if any line's key and value text is blank, otherwise calls [add_line]
+        Updates whether the edited line's key and value text is blank, calls
+        [add_line] if no line is blank anymore
+
+        Parameters
+        ----------
+        line : int
+            Index of the edited line in [rows]
         """
-        for row in range(self.first_manual_row, self.data_frame.rowCount()):
-            if (
-                self.data_frame.cellWidget(row, 0).text() == ""
-                and self.data_frame.cellWidget(row, 1).text() == ""
-            ):
-                return
-        self._add_line()
+        key, value = self.rows[line]
+        if key.text() == "" and value.text() == "":
+            self.empty_lines.add(line)
+            return
+        self.empty_lines.discard(line)
+        if not self.empty_lines:
+            self._add_line()
@@ -1,5 +1,6 @@
+import os
+
 from qtpy.QtWidgets import QFileDialog
-from msi_explorer import Maldi_MS
 
 
 def open_dialog(parent, filetype="", directory=""):
@@ -20,19 +21,41 @@ def open_dialog(parent, filetype="", directory=""):
     str
         Path of the selected file
     """
-    dialog = QFileDialog()
-    filepath = dialog.getOpenFileName(
+    filepath, _ = QFileDialog.getOpenFileName(
         parent, "Select imzML file", filter=filetype, directory=directory
-    )[0]
+    )
     return filepath
 
 
 def select_directory(parent):
-    dialog = QFileDialog()
-    filepath = dialog.getExistingDirectory(parent)
+    filepath = QFileDialog.getExistingDirectory(parent)
     return filepath
 
 
+def prefetch_binary_file(filename):
+    """
+    Asks the OS to read the .ibd file of an imzML file into its cache, so
+    the spectra are in memory once the XML part has been parsed
+
+    Parameters
+    ----------
+    filename : str
+        Path to an .imzML file
+    """
+    if not hasattr(os, "posix_fadvise"):
+        # only available on Linux and some other Unix systems
+        return
+    stem = os.path.splitext(filename)[0]
+    for extension in (".ibd", ".IBD"):
+        if os.path.isfile(stem + extension):
+            fd = os.open(stem + extension, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+            return
+
+
 def napari_get_reader(path):
     """
     Determines reader type for file(s) at [path]
@@ -75,5 +98,7 @@ def reader_function(filename):
     -------
         Maldi_MS object
     """
+    # imported here, napari imports the reader module for every opened file
+    from ._maldi_ms_data import Maldi_MS
 
     return Maldi_MS(filename)
@@ -1,8 +1,8 @@
-import csv
 import os
 import math
 import cv2
 from qtpy.QtWidgets import (
+    QApplication,
     QWidget,
     QVBoxLayout,
     QHBoxLayout,
@@ -14,21 +14,64 @@ from qtpy.QtWidgets import (
     QSizePolicy,
     QGridLayout,
 )
+from qtpy.QtCore import Qt, QTimer, QSortFilterProxyModel
+from qtpy.QtGui import QStandardItem, QStandardItemModel
 
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import (
     FigureCanvasQTAgg as FigureCanvas,
 )
 from matplotlib.widgets import SpanSelector
+from matplotlib.collections import LineCollection
 import numpy as np
 import napari
 from PIL import ImageFont, ImageDraw, Image
 
 from ._database import DatabaseWindow
-from ._true_mean_spec import get_true_mean_spec
+from ._maldi_ms_data import envelope
+from ._true_mean_spec import get_true_mean_spec, CHUNK_SIZE
 from ._writer import save_dialog
 from ._spectre_du_roi import spectre_du_roi
 
+# file filters of the export dialogs
+CSV_FILTER = "*.csv"
+PNG_FILTER = "*.png"
+
+# item data role holding the lowercase search text of a metabolite
+SEARCH_ROLE = Qt.UserRole + 1
+
+# number of data points formatted and written at once by export_spectrum_data
+EXPORT_BLOCK_SIZE = 1000000
+
+# style of the horizontal lines separating the sections of the window
+SEPARATOR_STYLE = "background-color: #c0c0c0"
+
+# delay in ms before the ion image of the selected m/z value is calculated
+MZ_DEBOUNCE_INTERVAL = 150
+
+# delay in ms before a span selection is plotted, coalesces bursts of
+# selections into one redraw
+SELECT_DEBOUNCE_INTERVAL = 30
+
+# minimum number of buckets of a downsampled profile spectrum
+MIN_PLOT_BUCKETS = 1000
+
+
+def _separator():
+    """
+    Creates a horizontal line to separate sections of the window
+
+    Returns
+    -------
+    QWidget
+        The line
+    """
+    line = QWidget()
+    line.setFixedHeight(4)
+    line.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+    line.setStyleSheet(SEPARATOR_STYLE)
+    return line
+
 
 class SelectionWindow(QWidget):
     """
@@ -40,6 +83,8 @@ class SelectionWindow(QWidget):
         The Napari viewer instance
     metabolites : dict
         Holds all information about m/z, (name, description)
+    metabolite_mzs : ndarray
+        m/z values of the metabolites as floats, in the order of metabolites
     label_mz_annotation : QLabel
         Displays description of m/z
     radio_btn_replace_layer : QRadioButton
@@ -50,14 +95,28 @@ class SelectionWindow(QWidget):
         Filter string for metabolites
     combobox_mz : QComboBox
         Holds all selectable m/z values
+    mz_search_texts : list
+        Lowercase m/z, names and descriptions of each modified metabolite,
+        searched by filter_mzs
+    mz_model : QStandardItemModel
+        All m/z values of the modified metabolites with their search texts
+    mz_proxy : QSortFilterProxyModel
+        Filters mz_model for combobox_mz
+    mz_timer : QTimer
+        Delays the ion image of the selected m/z value until the selection
+        has settled
+    select_timer : QTimer
+        Delays the plot of a span selection to coalesce bursts of selections
     database_window : QWidget
         The window to select databases to be used
     ms_object : Maldi_MS
         Maldi_MS object holding the metadata
-    data_array : array
-        array holding X and Y coordinates of the current spectrum
-    displayed_data : array
-        array holding X and Y coordinates of the currently displayed part of the current spectrum
+    current_spectrum : tuple
+        tuple holding contiguous numpy arrays with m/z and intensities of the
+        current spectrum
+    displayed_data : tuple
+        tuple holding views of m/z and intensities of the currently displayed
+        part of the current spectrum
     sample_mean_spectrum : tuple
         tuple holding numpy arrays with X and Y coordinates of the mean spectrum
 
@@ -77,6 +136,8 @@ class SelectionWindow(QWidget):
         Replaces/Adds new image layer with selected m/z & tolerance
     set_data()
         Set MSObject and the current spectrum data as attributes
+    invalidate_image()
+        Makes display_image calculate the next image again
     update_mzs()
         Updates the m/z values displayed in the combobox to match those selected from the databases
     display_description()
@@ -106,8 +167,19 @@ class SelectionWindow(QWidget):
         self.canvas = self.initialize_plot()
 
         self.metabolites = {}
+        self.metabolite_mzs = np.empty(0)
         self.modified_metabolites = {}
+        self.mz_search_texts = []
         self.mean_spectra = {}
+        self.database_window = None
+        self._tolerance = 0.1
+        self._last_mz_key = None
+        self._cursor_pick_pending = False
+        self._busy = False
+        self._plot_dirty = False
+        self.ms_object = None
+        self.current_spectrum = None
+        self._view_lo, self._view_hi = 0, 0
 
         ### QObjects
 
@@ -189,51 +261,53 @@ class SelectionWindow(QWidget):
         self.radio_btn_replace_layer.toggle()
 
         # Lineedits
-        self.lineedit_mz_range = QLineEdit("0.1")
+        self.lineedit_mz_range = QLineEdit(str(self._tolerance))
         self.lineedit_mz_range.setMaximumWidth(100)
         self.lineedit_mz_filter = QLineEdit()
         self.lineedit_mz_filter.setMaximumWidth(400)
         self.lineedit_mz_filter.setPlaceholderText("Filter")
 
         self.lineedit_mz_filter.editingFinished.connect(self.filter_mzs)
+        self.lineedit_mz_range.editingFinished.connect(self._update_tolerance)
 
         # Comboboxes
         self.combobox_mz = QComboBox()
         self.combobox_mz.setMinimumWidth(100)
         self.combobox_mz.setMaximumWidth(200)
         self.combobox_mz.setInsertPolicy(QComboBox.InsertAlphabetically)
+        # all m/z values are in the model, the proxy filters them
+        self.mz_model = QStandardItemModel(self)
+        self.mz_proxy = QSortFilterProxyModel(self)
+        self.mz_proxy.setSourceModel(self.mz_model)
+        self.mz_proxy.setFilterRole(SEARCH_ROLE)
+        self.mz_proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.combobox_mz.setModel(self.mz_proxy)
         self.combobox_adduct = QComboBox()
         self.combobox_adduct.setInsertPolicy(QComboBox.InsertAlphabetically)
         self.combobox_charge = QComboBox()
         self.combobox_charge.setInsertPolicy(QComboBox.InsertAlphabetically)
         self.combobox_charge.addItems(["neutral", "positive", "negative"])
 
-        self.combobox_mz.currentTextChanged.connect(self.display_image)
+        # the ion image is calculated once the selection has settled
+        self.mz_timer = QTimer(self)
+        self.mz_timer.setSingleShot(True)
+        self.mz_timer.setInterval(MZ_DEBOUNCE_INTERVAL)
+        self.mz_timer.timeout.connect(
+            lambda: self.display_image(self.combobox_mz.currentText())
+        )
+        self.combobox_mz.currentTextChanged.connect(
+            lambda _: self.mz_timer.start()
+        )
         self.combobox_mz.currentTextChanged.connect(self.display_description)
         self.combobox_charge.currentTextChanged.connect(self.update_adducts)
         self.update_adducts()
         self.combobox_adduct.currentTextChanged.connect(self.update_mzs)
 
         # Lines
-        line_1 = QWidget()
-        line_1.setFixedHeight(4)
-        line_1.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
-        line_1.setStyleSheet("background-color: #c0c0c0")
-
-        line_2 = QWidget()
-        line_2.setFixedHeight(4)
-        line_2.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
-        line_2.setStyleSheet("background-color: #c0c0c0")
-
-        line_3 = QWidget()
-        line_3.setFixedHeight(4)
-        line_3.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
-        line_3.setStyleSheet("background-color: #c0c0c0")
-
-        line_4 = QWidget()
-        line_4.setFixedHeight(4)
-        line_4.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
-        line_4.setStyleSheet("background-color: #c0c0c0")
+        line_1 = _separator()
+        line_2 = _separator()
+        line_3 = _separator()
+        line_4 = _separator()
 
         ### Organize objects via widgets
 
@@ -306,34 +380,18 @@ class SelectionWindow(QWidget):
         @self.viewer.bind_key("s")
         def read_cursor_position(viewer):
             """
-            Gets index of spectrum at cursor position,
-            gets spectrum at index,
-            passes spectrum to [update_plot]
+            Shows the spectrum at the cursor position
 
             Parameters
             ----------
             viewer : Viewer
                 The Napari viewer instance
             """
-            position = viewer.cursor.position
-            # Add +1 due to data coordinates starting at (1,1)
-            x = int(round(position[1]) / self.SCALE_FACTOR) + 1
-            y = int(round(position[0]) / self.SCALE_FACTOR) + 1
-            print(f"position: {position}, x: {x}, y: {y}")
-            index = self.ms_object.get_index(y, x)
-            if index == -1:
-                return
-            normalized = f"Normalized ({self.ms_object.norm_type})"
-            title = f"{normalized if self.ms_object.is_norm else 'Original'} {(y, x)}, #{index}"
-            spectrum = self.ms_object.get_spectrum(index)
-            self.current_spectrum = np.asarray(spectrum)
-            self.plot_spectrum(title=title)
+            self._show_spectrum_at_cursor()
 
     def keyPressEvent(self, event):
         """
-        Gets index of spectrum at event position,
-        gets spectrum at index,
-        passes spectrum to [update_plot]
+        Shows the spectrum at the cursor position when "s" is pressed
 
         Parameters
         ----------
@@ -341,19 +399,57 @@ class SelectionWindow(QWidget):
             The Event calling this function
         """
         if event.text() == "s":
-            position = self.viewer.cursor.position
-            # Add +1 due to data coordinates starting at (1,1)
-            x = int(round(position[1]) / self.SCALE_FACTOR) + 1
-            y = int(round(position[0]) / self.SCALE_FACTOR) + 1
-            print(f"x: {x}, y: {y}")
-            index = self.ms_object.get_index(y, x)
-            if index == -1:
-                return
-            normalized = f"Normalized ({self.ms_object.norm_type})"
-            title = f"{normalized if self.ms_object.is_norm else 'Original:'} {(y, x)}, #{index}"
-            spectrum = self.ms_object.get_spectrum(index)
-            self.current_spectrum = np.asarray(spectrum)
-            self.plot_spectrum(title=title)
+            self._show_spectrum_at_cursor()
+
+    def _show_spectrum_at_cursor(self):
+        """
+        Gets index of spectrum at cursor position,
+        gets spectrum at index,
+        passes spectrum to [plot_spectrum]
+        """
+        # the spectra are changed by the preprocessing, see set_busy
+        if self._busy:
+            return
+        # the viewer key binding and keyPressEvent may both handle the same
+        # key press, the spectrum is only read once per event loop iteration
+        if self._cursor_pick_pending:
+            return
+        self._cursor_pick_pending = True
+        QTimer.singleShot(0, self._end_cursor_pick)
+
+        position = self.viewer.cursor.position
+        # Add +1 due to data coordinates starting at (1,1)
+        x = int(round(position[1]) / self.SCALE_FACTOR) + 1
+        y = int(round(position[0]) / self.SCALE_FACTOR) + 1
+        print(f"position: {position}, x: {x}, y: {y}")
+        index = self.ms_object.get_index(y, x)
+        if index == -1:
+            return
+        normalized = f"Normalized ({self.ms_object.norm_type})"
+        title = f"{normalized if self.ms_object.is_norm else 'Original'} {(y, x)}, #{index}"
+        # get_index only returns valid indices or -1
+        spectrum = self.ms_object.get_spectrum_unchecked(index)
+        self.set_current_spectrum(spectrum)
+        self.plot_spectrum(title=title)
+
+    def set_busy(self, busy):
+        """
+        Blocks or allows reading the spectra, the window is disabled and the
+        "s" key of the viewer does nothing while the spectra are changed
+
+        Parameters
+        ----------
+        busy : bool
+            True while the spectra are changed in a background thread
+        """
+        self._busy = busy
+        self.setEnabled(not busy)
+
+    def _end_cursor_pick(self):
+        """
+        Allows the next key press to show a spectrum
+        """
+        self._cursor_pick_pending = False
 
     def initialize_plot(self):
         figure = Figure(figsize=(6, 6))
@@ -362,40 +458,143 @@ class SelectionWindow(QWidget):
         axes.tick_params(axis="y")
         axes.set_xlabel("m/z")
         axes.set_ylabel("intensity")
-
-        axes.plot()
+        axes.ticklabel_format(useOffset=False)
+
+        # persistent artists, plot_spectrum only replaces their data:
+        # a line for profile spectra, stems and a baseline for centroid
+        # spectra (as drawn by axes.stem)
+        (self.line,) = axes.plot([], [])
+        self.stems = LineCollection([], colors="C0")
+        axes.add_collection(self.stems)
+        (self.baseline,) = axes.plot([], [], "C3-")
         self.axes = axes
         canvas = FigureCanvas(figure)
 
+        # only the last selected range is plotted once the timer fires
+        self._selected_range = None
+        self.select_timer = QTimer(self)
+        self.select_timer.setSingleShot(True)
+        self.select_timer.setInterval(SELECT_DEBOUNCE_INTERVAL)
+        self.select_timer.timeout.connect(self._plot_selected_range)
+
         def onselect(min, max):
-            if not hasattr(self, "current_spectrum"):
-                return
-            min_bound_data = self.current_spectrum[
-                :, self.current_spectrum[0, :] >= min
-            ]
-            selected_data = min_bound_data[:, min_bound_data[0, :] <= max]
-            self.plot_spectrum(selected_data)
+            self._selected_range = (min, max)
+            self.select_timer.start()
 
+        # blitting only redraws the selection rectangle while dragging
         self.selector = SpanSelector(
-            axes, onselect=onselect, direction="horizontal"
+            axes, onselect=onselect, direction="horizontal", useblit=True
         )
         return canvas
 
+    def _plot_selected_range(self):
+        """
+        Plots the part of the current spectrum in the last selected m/z range
+        """
+        if self.current_spectrum is None or self._selected_range is None:
+            return
+        min, max = self._selected_range
+        mz, intensities = self.current_spectrum
+        # m/z values are sorted, the selected range is a view
+        lo = np.searchsorted(mz, min, "left")
+        hi = np.searchsorted(mz, max, "right")
+        self.plot_spectrum((mz[lo:hi], intensities[lo:hi]))
+
     def plot_spectrum(self, spectrum=None, title=None):
         if title is None:
             title = self.axes.get_title()
-        self.axes.clear()
-        self.axes.set_xlabel("m/z")
-        self.axes.set_ylabel("intensity")
         if spectrum is None:
             spectrum = self.current_spectrum
-        if self.ms_object.check_centroid():
-            self.axes.stem(*spectrum, markerfmt = " ")
+        mz, intensities = spectrum
+        centroid = self.ms_object.check_centroid() and len(mz) > 0
+        if centroid:
+            # vertical lines from 0 to the intensities
+            segments = np.zeros((len(mz), 2, 2))
+            segments[:, :, 0] = mz[:, np.newaxis]
+            segments[:, 1, 1] = intensities
+            self.stems.set_segments(segments)
+            self.baseline.set_data([mz[0], mz[-1]], [0, 0])
+            self.line.set_data([], [])
         else:
-            self.axes.plot(*spectrum)
-        self.axes.ticklabel_format(useOffset=False)
+            self.stems.set_segments([])
+            self.baseline.set_data([], [])
+            # no more points than pixels, see envelope
+            num_buckets = max(MIN_PLOT_BUCKETS, self.canvas.width())
+            self.line.set_data(*envelope(mz, intensities, num_buckets))
         self.axes.set_title(title)
-        self.canvas.draw()
+
+        # the data limits are known from the sorted m/z values and the
+        # intensity range, no relim pass over the artists is needed
+        limits = None
+        if len(mz) > 0:
+            low, high = intensities.min(), intensities.max()
+            if centroid:
+                # the stems and the baseline start at 0
+                low, high = min(low, 0), max(high, 0)
+            limits = np.array([[mz[0], low], [mz[-1], high]], dtype=np.float64)
+        if limits is not None and np.isfinite(limits).all():
+            self.axes.dataLim.set_points(limits)
+            self.axes.ignore_existing_data_limits = False
+        else:
+            # relim skips the hidden rectangle of the span selector and
+            # values that are not finite
+            self.axes.relim(visible_only=True)
+        self.axes.autoscale_view()
+        self.canvas.draw_idle()
+        self._plot_dirty = True
+        self._update_view(spectrum)
+
+    def set_current_spectrum(self, spectrum):
+        """
+        Stores a copy of the spectrum as two contiguous arrays sorted by m/z,
+        both keep the precision of the data (no common upcast to float64 as
+        for a 2xN array)
+
+        Parameters
+        ----------
+        spectrum : list
+            Arrays of m/z values and intensities
+        """
+        # a copy, the spectra of ms_object are changed in place by the
+        # preprocessing, the plotted and exported data must not change
+        mz = np.array(spectrum[0], order="C")
+        intensities = np.array(spectrum[1], order="C")
+        # the span selection and displayed_data search the sorted m/z values
+        if np.any(mz[1:] < mz[:-1]):
+            order = np.argsort(mz, kind="stable")
+            mz, intensities = mz[order], intensities[order]
+        self.current_spectrum = (mz, intensities)
+        self._view_lo, self._view_hi = 0, len(mz)
+
+    def _update_view(self, spectrum):
+        """
+        Remembers which part of the current spectrum is displayed
+
+        Parameters
+        ----------
+        spectrum : tuple
+            The displayed (part of the current) spectrum, sorted by m/z
+        """
+        if len(spectrum[0]) == 0:
+            self._view_lo, self._view_hi = 0, 0
+            return
+        mz = self.current_spectrum[0]
+        self._view_lo = int(np.searchsorted(mz, spectrum[0][0], "left"))
+        self._view_hi = int(np.searchsorted(mz, spectrum[0][-1], "right"))
+
+    @property
+    def displayed_data(self):
+        """
+        The currently displayed part of the current spectrum
+
+        Returns
+        -------
+        tuple
+            Views of the m/z values and intensities
+        """
+        mz, intensities = self.current_spectrum
+        view = slice(self._view_lo, self._view_hi)
+        return mz[view], intensities[view]
 
     def reset_plot(self):
         """
@@ -413,10 +612,20 @@ class SelectionWindow(QWidget):
 
     def select_database(self):
         """
-        Opens a [DatabaseWindow]
+        Opens a [DatabaseWindow], the window is created once and reused
         """
-        self.database_window = DatabaseWindow(self)
+        if self.database_window is None:
+            self.database_window = DatabaseWindow(self)
+            self.database_window.destroyed.connect(self._database_window_destroyed)
         self.database_window.show()
+        self.database_window.raise_()
+        self.database_window.activateWindow()
+
+    def _database_window_destroyed(self):
+        """
+        Forgets the deleted [DatabaseWindow] so the next click creates a new one
+        """
+        self.database_window = None
 
     def display_image(self, mz, tolerance=None):
         """
@@ -433,7 +642,15 @@ class SelectionWindow(QWidget):
             return
         mz = float(mz)
         if tolerance == None:
-            tolerance = float(self.lineedit_mz_range.text())
+            tolerance = self._tolerance
+        replace = self.radio_btn_replace_layer.isChecked()
+        if (
+            replace
+            and (mz, tolerance) == self._last_mz_key
+            and "main view" in self.viewer.layers
+        ):
+            # the main view already shows this image
+            return
         try:
             image = self.ms_object.get_ion_image(mz, tolerance)
         except AttributeError:
@@ -444,12 +661,13 @@ class SelectionWindow(QWidget):
         dims = (height, width)
         image = cv2.resize(image, None, fx = self.SCALE_FACTOR, fy = self.SCALE_FACTOR, interpolation = cv2.INTER_NEAREST)
         print(f"scaling image with factor {self.SCALE_FACTOR} for a total of {image.size} pixels")
-        if self.radio_btn_replace_layer.isChecked():
+        if replace:
             try:
                 self.viewer.layers.remove("main view")
             except ValueError:
                 pass
             layer = self.viewer.add_image(image, name="main view", colormap="inferno")
+            self._last_mz_key = (mz, tolerance)
         else:
             layername = (
                 "m/z "
@@ -465,6 +683,16 @@ class SelectionWindow(QWidget):
 
         self.add_colorbar(layer)
 
+    def _update_tolerance(self):
+        """
+        Parses the tolerance once the user has finished editing it, an invalid
+        value is replaced by the last valid one
+        """
+        try:
+            self._tolerance = float(self.lineedit_mz_range.text())
+        except ValueError:
+            self.lineedit_mz_range.setText(str(self._tolerance))
+
     def add_colorbar(self, layer):
         """
         Adds a colorbar for the image
@@ -572,7 +800,15 @@ class SelectionWindow(QWidget):
             Arrays of X/Y coordinates of spectrum
         """
         self.ms_object = ms_data
-        self.current_spectrum = np.array(data)
+        self.invalidate_image()
+        self.set_current_spectrum(data)
+
+    def invalidate_image(self):
+        """
+        Makes display_image calculate the next image again, also for an
+        unchanged m/z value and tolerance (e.g. after the preprocessing)
+        """
+        self._last_mz_key = None
 
     def update_mzs(self):
         """
@@ -580,13 +816,36 @@ class SelectionWindow(QWidget):
         """
         if self.combobox_adduct.count() == 0:
             return
-        self.combobox_mz.clear()
         adduct = self.combobox_adduct.currentText()
         if adduct == "exact mass":
             self.modified_metabolites = self.metabolites
         else:
             self.recalculate_masses(adduct)
-        self.combobox_mz.addItems(list(self.modified_metabolites))
+
+        # lowercase m/z, names and descriptions of each entry in one string
+        # for filter_mzs, "\0" keeps the query from matching across them
+        self.mz_search_texts = [
+            "\0".join(
+                [str(entry)]
+                + [metabolite[0] for metabolite in metabolites]
+                + [metabolite[1] for metabolite in metabolites]
+            ).lower()
+            for entry, metabolites in self.modified_metabolites.items()
+        ]
+        items = []
+        for entry, search_text in zip(
+            self.modified_metabolites, self.mz_search_texts
+        ):
+            item = QStandardItem(entry)
+            item.setData(search_text, SEARCH_ROLE)
+            items.append(item)
+
+        # no signals for the intermediate states, filter_mzs sends one
+        self.combobox_mz.blockSignals(True)
+        self.mz_model.clear()
+        if items:
+            self.mz_model.appendColumn(items)
+        self.combobox_mz.blockSignals(False)
         self.filter_mzs()
         
     def recalculate_masses(self, adduct:str):
@@ -647,10 +906,13 @@ class SelectionWindow(QWidget):
                 value = f(value,times*78.918885)
             adduct = adduct[1:]
         
+        # one vectorized calculation for all metabolites
+        modified_mzs = (self.metabolite_mzs * mass + value) / abs(charge)
         self.modified_metabolites = {}
-        for metabolite in self.metabolites:
-            modified_metabolite = float(metabolite) * mass + value
-            modified_metabolite = str(round(modified_metabolite / abs(charge),4))
+        for metabolite, modified_metabolite in zip(
+            self.metabolites, modified_mzs.tolist()
+        ):
+            modified_metabolite = str(round(modified_metabolite, 4))
             self.modified_metabolites[modified_metabolite] = self.metabolites[metabolite]
 
     def display_description(self, mz):
@@ -666,12 +928,12 @@ class SelectionWindow(QWidget):
             self.label_mz_annotation.setText("")
             self.label_mz_annotation.setToolTip("")
             return
-        try:
-            name = self.modified_metabolites[str(mz)][0][0]
-        except ValueError:
+        # one lookup for the name and the description
+        metabolites = self.modified_metabolites.get(str(mz))
+        if not metabolites:
             return
+        name, description = metabolites[0]
         self.label_mz_annotation.setText(name)
-        description = self.modified_metabolites[str(mz)][0][1]
         self.label_mz_annotation.setToolTip(description)
 
     def filter_mzs(self):
@@ -679,40 +941,21 @@ class SelectionWindow(QWidget):
         Filters the metabolites' m/z values displayed in the self.combobox_mz to display only those
         matching the filter_text. Checks m/z value, name and description.
         """
-        filter_text = self.lineedit_mz_filter.text().lower()
-        self.combobox_mz.clear()
-        for entry in self.modified_metabolites:
-            string_list = [str(entry).lower()]
-            string_list.extend(
-                [metabolite[0].lower() for metabolite in self.modified_metabolites[str(entry)]]
-            )
-            string_list.extend(
-                [metabolite[1].lower() for metabolite in self.modified_metabolites[str(entry)]]
-            )
-            if self.has_substring(string_list, filter_text):
-                self.combobox_mz.addItem(entry)
-
-    def has_substring(self, string_list, query):
-        """
-        Checks if any of the strings in string_list contain the query
-
-        Parameters
-        ----------
-        string_list : list
-            list of strings to check
-        query : str
-            string to check for in string_list
-        """
-        for string in string_list:
-            if query in string:
-                return True
-        return False
+        # the proxy model filters the m/z values by their search texts
+        self.combobox_mz.blockSignals(True)
+        self.mz_proxy.setFilterFixedString(self.lineedit_mz_filter.text())
+        if self.combobox_mz.currentIndex() == -1:
+            self.combobox_mz.setCurrentIndex(0)
+        self.combobox_mz.blockSignals(False)
+        # one signal for the refilled list, the metabolites behind an
+        # unchanged m/z text may differ after a change of the adduct
+        self.combobox_mz.currentTextChanged.emit(self.combobox_mz.currentText())
 
     def display_image_from_plot(self):
         """
         Displays image of the currently displayed m/z range in the plot
         """
-        if not hasattr(self, "current_spectrum"):
+        if self.current_spectrum is None:
             return
         low, high = self.get_plot_limits()
         tolerance = (high - low) / 2
@@ -751,11 +994,11 @@ class SelectionWindow(QWidget):
 
         worker = spectre_du_roi(self.ms_object, indices)
         worker.returned.connect(self.display_roi_mean_spectrum)
-        worker.start()
+        self._start_mean_spectrum(worker)
 
     def display_roi_mean_spectrum(self, spectrum):
-        spectrum = np.asarray(spectrum)
-        self.current_spectrum = spectrum
+        self.set_current_spectrum(spectrum)
+        spectrum = self.current_spectrum
         normalized = f"Normalized ({self.ms_object.norm_type})"
         title = (
             f"{normalized if self.ms_object.is_norm else 'Original'} ROI mean"
@@ -768,18 +1011,60 @@ class SelectionWindow(QWidget):
         """
         if not self.ms_object.norm_type in self.mean_spectra:
             print("calculating..")
-            worker = get_true_mean_spec(self.ms_object)
-            worker.returned.connect(self.display_true_mean_spectrum)
-            worker.start()
+            # one step of the progress bar per merged chunk of spectra
+            num_chunks = math.ceil(self.ms_object.get_num_spectra() / CHUNK_SIZE)
+            worker = get_true_mean_spec(
+                self.ms_object,
+                _progress={"total": num_chunks, "desc": "True mean spectrum"},
+            )
+            # the normalization of the spectra the mean is calculated from
+            norm_type = self.ms_object.norm_type
+            worker.returned.connect(
+                lambda spectrum: self.display_true_mean_spectrum(
+                    spectrum, norm_type
+                )
+            )
+            self._start_mean_spectrum(worker)
         else:
             print("using existing spectrum")
             spectrum = self.mean_spectra[self.ms_object.norm_type]
             normalized = f"Normalized ({self.ms_object.norm_type})"
             title = f"{normalized if self.ms_object.is_norm else 'Original'} true mean"
-            self.plot_spectrum(spectrum, title)
-            self.current_spectrum = spectrum
+            self.set_current_spectrum(spectrum)
+            self.plot_spectrum(self.current_spectrum, title)
+
+    def _start_mean_spectrum(self, worker):
+        """
+        Starts a worker calculating a mean spectrum, the mean spectrum buttons
+        and the buttons changing the spectra (preprocessing, loading a file)
+        are disabled until it has finished
 
-    def display_true_mean_spectrum(self, spectrum):
+        Parameters
+        ----------
+        worker : WorkerBase
+            The worker calculating the mean spectrum in a background thread
+        """
+        # the GUI is only changed here and in the slot, never in the worker
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        self.btn_true_mean_spectrum.setEnabled(False)
+        self.btn_select_roi.setEnabled(False)
+        # the worker reads the spectra, they must not be changed meanwhile
+        self.parent.btn_execute_preprocessing.setEnabled(False)
+        self.parent.btn_load_imzml.setEnabled(False)
+        worker.finished.connect(self._mean_spectrum_finished)
+        worker.start()
+
+    def _mean_spectrum_finished(self):
+        """
+        Restores the cursor and the buttons disabled by _start_mean_spectrum
+        """
+        QApplication.restoreOverrideCursor()
+        self.btn_true_mean_spectrum.setEnabled(True)
+        self.btn_select_roi.setEnabled(True)
+        self.parent.btn_execute_preprocessing.setEnabled(True)
+        self.parent.btn_load_imzml.setEnabled(True)
+
+    def display_true_mean_spectrum(self, spectrum, norm_type=None):
         """
         Displays the true mean spectrum and writes it to variable
 
@@ -787,50 +1072,54 @@ class SelectionWindow(QWidget):
         ----------
         spectrum : list
             true mean spectrum
+        norm_type : str
+            normalization of the spectra when the calculation started, the
+            current one if None
         """
-        spectrum = np.asarray(spectrum)
-        self.mean_spectra[self.ms_object.norm_type] = spectrum
-        self.current_spectrum = spectrum
-        normalized = f"Normalized ({self.ms_object.norm_type})"
-        title = (
-            f"{normalized if self.ms_object.is_norm else 'Original'} true mean"
-        )
+        if norm_type is None:
+            norm_type = self.ms_object.norm_type
+        self.set_current_spectrum(spectrum)
+        spectrum = self.current_spectrum
+        self.mean_spectra[norm_type] = spectrum
+        normalized = f"Normalized ({norm_type})"
+        if norm_type == "original":
+            normalized = "Original"
+        title = f"{normalized} true mean"
         self.plot_spectrum(spectrum, title)
 
     def export_spectrum_data(self):
         """
         Exports the current spectrum data to csv
         """
-        file = save_dialog(self, "*.csv")
-        if file[0] == "":
+        path = save_dialog(self, CSV_FILTER)
+        if not path:
             # No file path + name chosen
             return
 
-        csvfile = open(file[0], "w", newline="")
-        writer = csv.writer(csvfile)
-        writer.writerow(["m/z", "intensity"])
-
-        low, high = self.get_plot_limits()
-        min_bound_data = self.current_spectrum[
-            :, self.current_spectrum[0, :] >= low
-        ]
-        displayed_data = min_bound_data[:, min_bound_data[0, :] <= high]
-        for i in range(len(displayed_data[0])):
-            data = [displayed_data[0, i], displayed_data[1, i]]
-            writer.writerow(data)
-        csvfile.close()
+        mz, intensities = self.displayed_data
+        with open(path, "wb") as csvfile:
+            csvfile.write(b"m/z,intensity\r\n")
+            # the rows are formatted by numpy in blocks, one write per block,
+            # like csv.writer each value is written as str() in its precision
+            for start in range(0, len(mz), EXPORT_BLOCK_SIZE):
+                block = slice(start, start + EXPORT_BLOCK_SIZE)
+                rows = np.char.add(
+                    np.char.add(mz[block].astype(str), ","),
+                    intensities[block].astype(str),
+                )
+                csvfile.write(("\r\n".join(rows.tolist()) + "\r\n").encode())
         print("export complete")
 
     def export_spectrum_plot(self):
         """
         Exports the current spectrum as [insert file format here]
         """
-        file = save_dialog(self, "*.png")
-        if file[0] == "":
+        path = save_dialog(self, PNG_FILTER)
+        if not path:
             # No file path + name chosen
             return
 
-        self.canvas.print_figure(file[0])
+        self.canvas.print_figure(path)
         print("image has been saved!")
         
     def update_adducts(self):
@@ -896,9 +1185,12 @@ class SelectionWindow(QWidget):
     def reset(self):
         self.ms_object = None
         self.current_spectrum = None
-        for ax in self.canvas.figure.axes:
-            ax.clear()
-            ax.set_xlabel("m/z")
-            ax.set_ylabel("intensity")
-
-        self.canvas.draw()
+        # Nothing has been drawn since the last reset, skip the redraw
+        if not self._plot_dirty:
+            return
+        self.line.set_data([], [])
+        self.stems.set_segments([])
+        self.baseline.set_data([], [])
+        self.axes.set_title("")
+        self.canvas.draw_idle()
+        self._plot_dirty = False
@@ -1,9 +1,8 @@
 import time
 
-import vaex
 from napari.qt.threading import thread_worker
-from qtpy.QtWidgets import QApplication
-from qtpy.QtCore import Qt
+
+from ._aggregation import merge_contiguous, select_spectra
 
 # Copyright © Peter Lampen, ISAS Dortmund, 2023
 # (04.07.2023)
@@ -29,7 +28,6 @@ def spectre_du_roi(maldi_ms, roi):
     """
 
     start_time = time.time()  # start time
-    QApplication.setOverrideCursor(Qt.WaitCursor)
 
     index = []  # Find the numbers of the spectra in the ROI
     for coord in roi:
@@ -42,26 +40,17 @@ def spectre_du_roi(maldi_ms, roi):
     if len(index) == 0:  # Is any spectrum in the ROI?
         raise ValueError("The ROI is empty")
 
-    spectra = maldi_ms.get_all_spectra()
-
-    spectra_df = [
-        vaex.from_arrays(mz=spectra[i][0], intens=spectra[i][1]) for i in index
-    ]  # convert all spectra to a DataFrame
-    df = vaex.concat(spectra_df)  # build one big DataFrame
-
-    df["mz"] = df.mz.round(4)  # round m/z to 4 decimal places
-    # add up the intensities for equal m/z values
-    df = df.groupby(df.mz, agg="sum", sort=True)
-
-    mz = df.mz.values.to_numpy()  # convert the DataFrame to NumPy 1D arrays
-    intens = df.intens_sum.values
-    result = [mz, intens]
+    # gather the spectra of the ROI from the contiguous arrays
+    mz, intensities, offsets = select_spectra( \
+        *maldi_ms.get_contiguous_spectra(), index)
+    # add up the intensities for equal m/z values (rounded to 4 decimal places)
+    result = merge_contiguous(mz, intensities, offsets)
+    mz, intens = result
 
     stop_time = time.time()
     print(f"run time: {round(stop_time - start_time, 2)} seconds")
-    print(f"count = {df.count()}")
-    print(f"m/z = {df.min(df.mz)} - {df.max(df.mz)}")
-    print(f"intensity = {df.min(df.intens_sum)} - {df.max(df.intens_sum):.3g}")
+    print(f"count = {len(mz)}")
+    print(f"m/z = {mz.min()} - {mz.max()}")
+    print(f"intensity = {intens.min()} - {intens.max():.3g}")
 
-    QApplication.restoreOverrideCursor()
     return result
@@ -0,0 +1,18 @@
+import os
+
+import pytest
+
+from msi_explorer import napari_get_reader
+
+FILENAME = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "data",
+    "Example_Processed.imzML",
+)
+
+
+@pytest.fixture(scope="session")
+def maldi_data():
+    """The example imzML file, parsed once for the whole test session"""
+    reader = napari_get_reader(FILENAME)
+    return reader(FILENAME)
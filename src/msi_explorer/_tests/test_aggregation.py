@@ -0,0 +1,64 @@
+"""pytest program for the module _aggregation.py"""
+import numpy as np
+
+from msi_explorer._aggregation import (
+    merge_spectra,
+    select_spectra,
+    sum_equal_mz,
+)
+
+
+def test_sum_equal_mz():
+    mz = np.array([100.00001, 200.0, 100.0, 150.5, 200.00002])
+    intens = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+    new_mz, new_intens = sum_equal_mz(mz, intens)
+    assert np.array_equal(new_mz, [100.0, 150.5, 200.0])
+    assert np.array_equal(new_intens, [4.0, 4.0, 7.0])
+
+
+def test_sum_equal_mz_empty():
+    new_mz, new_intens = sum_equal_mz(np.array([]), np.array([]))
+    assert len(new_mz) == 0
+    assert len(new_intens) == 0
+
+
+def test_merge_spectra():
+    spectrum1 = [np.array([100.0, 150.0, 200.0]), np.array([1.0, 2.0, 3.0])]
+    spectrum2 = [np.array([120.0, 150.00001]), np.array([4.0, 5.0])]
+    mz, intens = merge_spectra([spectrum1, spectrum2])
+    assert np.array_equal(mz, [100.0, 120.0, 150.0, 200.0])
+    assert np.array_equal(intens, [1.0, 4.0, 7.0, 3.0])
+
+
+def test_merge_spectra_single():
+    # equal m/z values after rounding within one spectrum
+    spectrum = [np.array([100.0, 100.00001, 200.0]), np.array([1.0, 2.0, 3.0])]
+    mz, intens = merge_spectra([spectrum])
+    assert np.array_equal(mz, [100.0, 200.0])
+    assert np.array_equal(intens, [3.0, 3.0])
+
+
+def test_merge_spectra_odd():
+    # three rounds of pairwise merging, an empty spectrum in between
+    spectra = [
+        [np.array([100.0, 300.0]), np.array([1.0, 2.0])],
+        [np.array([]), np.array([])],
+        [np.array([100.0, 200.0]), np.array([3.0, 4.0])],
+        [np.array([300.0]), np.array([5.0])],
+        [np.array([50.0, 200.0]), np.array([6.0, 7.0])],
+    ]
+    mz, intens = merge_spectra(spectra)
+    assert np.array_equal(mz, [50.0, 100.0, 200.0, 300.0])
+    assert np.array_equal(intens, [6.0, 4.0, 11.0, 7.0])
+
+
+def test_select_spectra():
+    mz = np.array([1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+    intens = np.array([10.0, 20.0, 30.0, 40.0, 50.0, 60.0])
+    offsets = np.array([0, 2, 2, 5, 6])
+    new_mz, new_intens, new_offsets = select_spectra(
+        mz, intens, offsets, [0, 1, 3]
+    )
+    assert np.array_equal(new_mz, [1.0, 2.0, 6.0])
+    assert np.array_equal(new_intens, [10.0, 20.0, 60.0])
+    assert np.array_equal(new_offsets, [0, 2, 2, 3])
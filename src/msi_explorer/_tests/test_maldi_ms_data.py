@@ -1,46 +1,48 @@
 """pytest program for the class Maldi_MS in the module _maldi_ms_data.py"""
+import os
+
 import numpy as np
-from msi_explorer import napari_get_reader
+import pytest
 
-FILENAME = "src/msi_explorer/_tests/data/Example_Processed.imzML"
-reader_function = napari_get_reader(FILENAME)
-maldi_ms = reader_function(FILENAME)
+from msi_explorer import _maldi_ms_data
+from msi_explorer._maldi_ms_data import Maldi_MS, envelope
+from msi_explorer._tests.conftest import FILENAME
 
 
-def test_init():
-    type1 = str(type(maldi_ms))
+def test_init(maldi_data):
+    type1 = str(type(maldi_data))
     assert type1 == "<class 'msi_explorer._maldi_ms_data.Maldi_MS'>"
 
 
-def test_check_i():
-    i = maldi_ms.check_i(23)
+def test_check_i(maldi_data):
+    i = maldi_data.check_i(23)
     assert i == 8
 
 
-def test_get_spectrum():
-    spec = maldi_ms.get_spectrum(3)
+def test_get_spectrum(maldi_data):
+    spec = maldi_data.get_spectrum(3)
     assert len(spec[0]) == 8399
     assert len(spec[1]) == 8399
     assert spec[0][5] == 100.5
 
 
-def test_get_num_spectra():
-    num = maldi_ms.get_num_spectra()
+def test_get_num_spectra(maldi_data):
+    num = maldi_data.get_num_spectra()
     assert num == 9
 
 
-def test_get_index():
-    index = maldi_ms.get_index(2, 2)
+def test_get_index(maldi_data):
+    index = maldi_data.get_index(2, 2)
     assert index == 4
 
 
-def test_get_coordinates():
-    coord = maldi_ms.get_coordinates(4)
+def test_get_coordinates(maldi_data):
+    coord = maldi_data.get_coordinates(4)
     assert coord == (2, 2, 1)
 
 
-def test_get_ion_image():
-    image = maldi_ms.get_ion_image(328.9, 0.25)
+def test_get_ion_image(maldi_data):
+    image = maldi_data.get_ion_image(328.9, 0.25)
     image = image.round(3)
     image2 = np.array(
         [[9.696, 6.044, 4.967], [7.814, 5.316, 2.866], [1.663, 4.916, 4.576]]
@@ -48,11 +50,91 @@ def test_get_ion_image():
     assert np.array_equal(image, image2)
 
 
-def test_get_metadata_json():
-    meta = maldi_ms.get_metadata_json()
+def test_get_metadata_json(maldi_data):
+    meta = maldi_data.get_metadata_json()
     assert meta[6:27] == '"file_description": {'
 
 
-def test_get_metadata():
-    meta = maldi_ms.get_metadata()
+def test_get_metadata(maldi_data):
+    meta = maldi_data.get_metadata()
     assert meta["pixel size x"] == 100.0
+
+
+def test_get_tic(maldi_data):
+    tic = maldi_data.get_tic()
+    assert len(tic) == 9
+    assert np.isclose(
+        tic[3], np.sum(maldi_data.spectra[3][1], dtype=np.float64)
+    )
+
+
+def test_envelope(maldi_data):
+    mz, intensities = maldi_data.get_spectrum(3)
+    new_mz, new_intens = envelope(mz, intensities, 100)
+    assert len(new_mz) == 200
+    assert new_intens.max() == intensities.max()
+    assert new_intens.min() == intensities.min()
+
+
+def test_get_ion_image_cache_key(maldi_data):
+    # the lower limits of the ranges are just below and just above a peak
+    # of the first spectrum, both round to the same 4 decimals
+    mz0 = float(maldi_data.get_spectrum(0)[0][100])
+    mz1, mz2 = mz0 + 0.1 - 1e-6, mz0 + 0.1 + 1e-6
+    assert round(mz1, 4) == round(mz2, 4)
+    image = maldi_data.get_ion_image(mz1, 0.1)
+    image2 = maldi_data.get_ion_image(mz2, 0.1)
+    assert not np.array_equal(image, image2)
+
+
+def _reference_factor(mz, intensities, norm, mz0, tol):
+    # divisor (tic, rms, median) or factor (peak) of one spectrum, as in
+    # the former loop over the spectra
+    nonzero = intensities[intensities != 0.0].astype(np.float64)
+    if norm == "tic":
+        return 1.0 / np.mean(nonzero)
+    if norm == "rms":
+        return 1.0 / np.sqrt(np.mean(np.square(nonzero)))
+    if norm == "median":
+        return 1.0 / np.median(nonzero)
+    peak = intensities[(mz >= mz0 - tol) & (mz <= mz0 + tol)]
+    if len(peak) == 0 or peak.max() <= 0.0:
+        return 0.0
+    return 100.0 / peak.max()
+
+
+@pytest.mark.parametrize("norm", ["tic", "rms", "median", "peak"])
+def test_normalize(norm):
+    # normalize changes the object, not the session fixture maldi_data
+    maldi_ms = Maldi_MS(FILENAME)
+    mz0 = float(maldi_ms.get_spectrum(0)[0][100])
+    tol = 0.05
+    maldi_ms.normalize(norm, mz0, tol)
+    assert maldi_ms.is_norm
+    for i in range(maldi_ms.get_num_spectra()):
+        mz, intensities = maldi_ms.spectra[i]
+        factor = _reference_factor(mz, intensities, norm, mz0, tol)
+        expected = intensities.astype(np.float64) * factor
+        assert np.allclose(maldi_ms.get_spectrum(i)[1], expected, rtol=1e-5)
+
+
+@pytest.mark.parametrize("preadv", [True, False])
+def test_read_spectra(monkeypatch, preadv):
+    # batches of 4 spectra, the 9 example spectra give batch boundaries at
+    # 4 and 8
+    monkeypatch.setattr(_maldi_ms_data, "READ_BATCH_SIZE", 4)
+    if not preadv and hasattr(os, "preadv"):
+        # the pread path with a temporary bytes object
+        monkeypatch.delattr(os, "preadv")
+    maldi_ms = Maldi_MS(FILENAME)
+    parser = maldi_ms.p
+    lengths = np.diff(maldi_ms._offsets)
+    assert maldi_ms._offsets[0] == 0
+    assert np.array_equal(lengths, parser.mzLengths)
+    last = maldi_ms.get_num_spectra() - 1
+    for i in (0, 3, 4, last):
+        mz, intensities = parser.getspectrum(i)
+        assert np.array_equal(maldi_ms.spectra[i][0], mz)
+        assert np.array_equal(
+            maldi_ms.spectra[i][1], intensities.astype(np.float32)
+        )
@@ -0,0 +1,22 @@
+"""pytest program for the disk cache of the module _true_mean_spec.py"""
+import os
+
+from msi_explorer._true_mean_spec import _cache_dir, _evict_cache
+
+
+def test_evict_cache(tmp_path):
+    # three stored spectra of 100 bytes, the first one is the oldest
+    for i in range(3):
+        path = tmp_path / f"{i}_true_mean.npz"
+        path.write_bytes(bytes(100))
+        os.utime(path, (1000 + i, 1000 + i))
+    _evict_cache(str(tmp_path), max_bytes=250)
+    assert sorted(os.listdir(tmp_path)) == [
+        "1_true_mean.npz",
+        "2_true_mean.npz",
+    ]
+
+
+def test_cache_dir_off(monkeypatch):
+    monkeypatch.setenv("MSI_EXPLORER_DISK_CACHE", "0")
+    assert _cache_dir() is None
@@ -1,3 +1,5 @@
+import numpy as np
+
 from msi_explorer import MSI_Explorer
 
 
@@ -19,3 +21,36 @@ def test_metadata(make_napari_viewer):
     my_widget = MSI_Explorer(viewer)
     my_widget.open_metadata()
     assert True
+
+
+def test_preprocessing_busy(make_napari_viewer):
+    ### Tests if the spectra can't be read while the preprocessing runs
+
+    viewer = make_napari_viewer()
+
+    my_widget = MSI_Explorer(viewer)
+    my_widget._set_preprocessing(True)
+    # no file is loaded, reading the spectrum would fail
+    my_widget.selection_window._show_spectrum_at_cursor()
+    assert not my_widget.btn_load_imzml.isEnabled()
+    assert not my_widget.selection_window.isEnabled()
+    my_widget._set_preprocessing(False)
+    assert my_widget.btn_load_imzml.isEnabled()
+
+
+def test_current_spectrum_copy(make_napari_viewer):
+    ### Tests if the current spectrum keeps its values when the spectra are
+    ### changed in place
+
+    viewer = make_napari_viewer()
+
+    my_widget = MSI_Explorer(viewer)
+    mz = np.array([100.0, 200.0, 300.0])
+    intensities = np.array([1.0, 2.0, 3.0], dtype=np.float32)
+    my_widget.selection_window.set_current_spectrum([mz, intensities])
+    intensities[:] = 0
+    assert my_widget.selection_window.current_spectrum[1].tolist() == [
+        1.0,
+        2.0,
+        3.0,
+    ]
@@ -17,3 +17,4 @@ def test_metadata_writer(tmp_path):
     write_metadata(testfile, data)
 
     assert os.path.isfile(testfile)
+    assert os.path.getsize(testfile) > 0
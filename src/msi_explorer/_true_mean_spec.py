@@ -1,14 +1,164 @@
+import hashlib
+import os
 import time
-import vaex
+import numpy as np
 from napari.qt.threading import thread_worker
-from qtpy.QtWidgets import QApplication
-from qtpy.QtCore import Qt
+from qtpy.QtCore import QStandardPaths
+
+from ._aggregation import merge_contiguous, merge_sorted
 
 # Copyright © Peter Lampen, ISAS Dortmund, 2023
 # (17.05.2023)
 
+# number of spectra merged at once, get_true_mean_spec yields after each chunk
+CHUNK_SIZE = 512
+
+# environment variable, "0" turns off storing the true mean spectra on disk
+CACHE_ENV_VAR = "MSI_EXPLORER_DISK_CACHE"
+
+# upper limit of the stored true mean spectra, the least recently used files
+# are deleted above it
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+def _cache_dir():
+    """
+    Directory of the true mean spectra stored between sessions, inside the
+    platform's cache location (XDG_CACHE_HOME, %LOCALAPPDATA%, ...)
+
+    Returns
+    -------
+    str or None
+        path of the directory, None if the disk cache is turned off
+    """
+
+    if os.environ.get(CACHE_ENV_VAR, "1") == "0":
+        return None
+    location = QStandardPaths.writableLocation(
+        QStandardPaths.GenericCacheLocation
+    )
+    if not location:
+        return None
+    return os.path.join(location, "msi_explorer")
+
+
+def _cache_file(maldi_ms):
+    """
+    Path of the stored true mean spectrum of the current spectra
+
+    Parameter
+    ---------
+    maldi_ms : object of the class Maldi_MS
+        the object contains spectra, coordinates and metadata
+
+    Returns
+    -------
+    str or None
+        path of the .npz file, None if the spectra differ from those in the
+        file (noise reduction, hotspot removal, centroid data) or the disk
+        cache is turned off
+    """
+
+    cache_dir = _cache_dir()
+    if cache_dir is None or maldi_ms.is_filtered or maldi_ms.is_centroid:
+        return None
+    # the key changes with the path, size and modification time of both files
+    key = [maldi_ms.norm_type]
+    try:
+        for path in (maldi_ms.filename, maldi_ms.p.m.name):
+            path = os.path.abspath(path)
+            stat = os.stat(path)
+            key.append(f"{path}:{stat.st_size}:{stat.st_mtime_ns}")
+    except (OSError, AttributeError):
+        return None
+    digest = hashlib.blake2b("\n".join(key).encode(), digest_size=16)
+    return os.path.join(cache_dir, f"{digest.hexdigest()}_true_mean.npz")
+
+
+def _load_mean_spec(path):
+    """
+    Reads a stored true mean spectrum
+
+    Parameter
+    ---------
+    path : str or None
+        path of the .npz file
+
+    Returns
+    -------
+    list or None
+        m/z and intensities, None if there is no readable file
+    """
+
+    if path is None:
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            result = [data["mz"], data["intensities"]]
+        # the modification time marks the last use for _evict_cache
+        os.utime(path)
+        return result
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _evict_cache(cache_dir, max_bytes=CACHE_MAX_BYTES):
+    """
+    Deletes the least recently used spectra until the stored spectra take up
+    at most max_bytes, this also removes those of changed or moved files
+
+    Parameter
+    ---------
+    cache_dir : str
+        directory of the stored spectra
+    max_bytes : int
+        upper limit of the size of all stored spectra
+    """
+
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith("_true_mean.npz"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def _save_mean_spec(path, spectrum):
+    """
+    Stores a true mean spectrum, a failure only skips the storing
+
+    Parameter
+    ---------
+    path : str or None
+        path of the .npz file
+    spectrum : list
+        m/z and intensities
+    """
+
+    if path is None:
+        return
+    cache_dir = os.path.dirname(path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary file first, a reader never sees half a file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(f, mz=spectrum[0], intensities=spectrum[1])
+        os.replace(temp_path, path)
+        _evict_cache(cache_dir)
+    except OSError as error:
+        print(f"the true mean spectrum could not be stored: {error}")
+
 
-@thread_worker
+@thread_worker(progress={"desc": "True mean spectrum"})
 def get_true_mean_spec(maldi_ms):
     """
     Calculation of the true mean spectrum from all spectra of an .ibd file
@@ -26,28 +176,43 @@ def get_true_mean_spec(maldi_ms):
     """
 
     start_time = time.time()  # start time
-    QApplication.setOverrideCursor(Qt.WaitCursor)
 
-    spectra = maldi_ms.get_all_spectra()
-    spectra_df = [
-        vaex.from_arrays(mz=spectrum[0], intens=spectrum[1])
-        for spectrum in spectra
-    ]  # convert all spectra to vaex DataFrames
-    df = vaex.concat(spectra_df)  # build one big DataFrame from all spectra
+    # the spectrum of an unchanged file is stored between sessions
+    cache_file = _cache_file(maldi_ms)
+    result = _load_mean_spec(cache_file)
+    if result is not None:
+        print(f"true mean spectrum read from {cache_file}")
+        return result
 
-    df["mz"] = df.mz.round(4)  # round m/z to 4 decimal places
-    # add up the intensities for equal m/z values
-    df = df.groupby(df.mz, agg="sum", sort=True)
+    # the current spectra as contiguous arrays, no list of spectra needed
+    mz, intensities, offsets = maldi_ms.get_contiguous_spectra()
+    num_spectra = len(offsets) - 1
 
-    mz = df.mz.values.to_numpy()  # convert the DataFrame to NumPy nDArrays
-    intens = df.intens_sum.values
-    result = [mz, intens]
+    # the chunks are merged into the running sums, only one chunk at a time
+    # is rounded and merged (memory for the sums and one chunk)
+    total_mz = np.empty(0, dtype=mz.dtype)
+    total_intens = np.empty(0, dtype=np.float64)
+    for first in range(0, num_spectra, CHUNK_SIZE):
+        last = min(first + CHUNK_SIZE, num_spectra)
+        start, end = offsets[first], offsets[last]
+        # add up the intensities for equal m/z values (rounded to 4 decimal
+        # places)
+        chunk_mz, chunk_intens = merge_contiguous(
+            mz[start:end], intensities[start:end],
+            offsets[first:last + 1] - start
+        )
+        total_mz, total_intens = merge_sorted(
+            total_mz, total_intens, chunk_mz, chunk_intens
+        )
+        yield
+    result = [total_mz, total_intens]
+    _save_mean_spec(cache_file, result)
+    mz, intens = result
 
     stop_time = time.time()
     print(f"run time: {round(stop_time - start_time, 2)} seconds")
-    print(f"count = {df.count()}")
-    print(f"m/z = {df.min(df.mz)} - {df.max(df.mz)}")
-    print(f"intensity = {df.min(df.intens_sum)} - {df.max(df.intens_sum):.4g}")
+    print(f"count = {len(mz)}")
+    print(f"m/z = {mz.min()} - {mz.max()}")
+    print(f"intensity = {intens.min()} - {intens.max():.4g}")
 
-    QApplication.restoreOverrideCursor()
     return result
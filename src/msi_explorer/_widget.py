@@ -17,17 +17,134 @@ from qtpy.QtWidgets import (
     QGroupBox,
     QCheckBox,
 )
-from qtpy.QtCore import Qt
-from qtpy.QtGui import QImage, QPixmap
-import cv2
+from qtpy.QtCore import Qt, Slot
+from qtpy.QtGui import QPixmap
+from napari.qt.threading import thread_worker
 
-from ._selection import SelectionWindow
-from ._metadata import MetadataWindow
-from ._reader import open_dialog, napari_get_reader
+from ._reader import open_dialog, napari_get_reader, prefetch_binary_file
 
 # if TYPE_CHECKING:
 #     import napari
 
+# style of the "Load imzML" button
+LOAD_BUTTON_STYLE = "QPushButton { font-size: 20px; }"
+
+# The logo is loaded and rescaled once, a QPixmap needs a QApplication
+_LOGO_PIXMAP = None
+
+
+def _get_logo():
+    """
+    Returns the rescaled logo, loads it on the first call
+
+    Returns
+    -------
+    QPixmap
+        The logo rescaled to 300x300 pixels
+    """
+    global _LOGO_PIXMAP
+    if _LOGO_PIXMAP is None:
+        filename = "logo.png"
+        absolute_path = os.path.dirname(os.path.abspath(__file__))
+        relative_path = os.path.join("ressources/", filename)
+        path = os.path.join(absolute_path, relative_path)
+        _LOGO_PIXMAP = QPixmap(path).scaled(
+            300, 300, Qt.KeepAspectRatio, Qt.SmoothTransformation
+        )
+    return _LOGO_PIXMAP
+
+
+@thread_worker(progress={"desc": "Reading imzML file"}, ignore_errors=True)
+def _read_file(file_reader, filepath):
+    """
+    Reads a file in a background thread
+
+    Parameters
+    ----------
+    file_reader : function
+        The reader returned by napari_get_reader
+    filepath : str
+        Path of the file
+
+    Returns
+    -------
+    tuple
+        Maldi_MS object holding the data of the file and the (m/z,
+        tolerance) of the calculated first ion image, None if there is none
+    """
+    # the OS reads the spectra while the XML part is parsed
+    prefetch_binary_file(filepath)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        ms_object = file_reader(filepath)
+
+    # the first ion image of _display_file (the whole m/z range of the
+    # center spectrum) is calculated here, the GUI thread asks for exactly
+    # this (m/z, tolerance) and finds it in the ion image cache of ms_object
+    ion_range = None
+    mz = ms_object.get_spectrum(_center_index(ms_object))[0]
+    if len(mz) > 0:
+        low, high = float(mz.min()), float(mz.max())
+        try:
+            ms_object.get_ion_image((high + low) / 2, (high - low) / 2)
+            ion_range = ((high + low) / 2, (high - low) / 2)
+        except RuntimeError:
+            # incorrect metadata, reported by _display_file
+            pass
+    return ms_object, ion_range
+
+
+def _center_index(ms_object):
+    """
+    Index of the spectrum in the center of the image, the default spectrum
+
+    Parameters
+    ----------
+    ms_object : Maldi_MS
+        Maldi_MS object holding the spectra
+
+    Returns
+    -------
+    int
+        Index of the spectrum, the middle spectrum of the file if there is
+        no spectrum at the center
+    """
+    metadata = ms_object.get_metadata()
+    x = int(metadata["max count x"] / 2)
+    y = int(metadata["max count y"] / 2)
+    index = ms_object.get_index(y, x)
+    if index == -1:
+        index = ms_object.get_num_spectra() // 2
+    return index
+
+
+@thread_worker(progress={"desc": "Preprocessing"}, ignore_errors=True)
+def _preprocess(ms_object, noise_limit, normalization_method, mz, hotspot_limit):
+    """
+    Runs the preprocessing steps in a background thread
+
+    Parameters
+    ----------
+    ms_object : Maldi_MS
+        Maldi_MS object holding the spectra
+    noise_limit : float or None
+        Percentage for the noise reduction, None to skip it
+    normalization_method : str
+        'original', 'tic', 'rms', 'median' or 'peak'
+    mz : float or None
+        m/z value of the reference peak, None for the default
+    hotspot_limit : float or None
+        Percentage for the hotspot removal, None to skip it
+    """
+    if noise_limit is not None:
+        ms_object.noise_reduction(noise_limit)
+    if mz is not None:
+        ms_object.normalize(normalization_method, mz)
+    else:
+        ms_object.normalize(normalization_method)
+    if hotspot_limit is not None:
+        ms_object.remove_hotspots(hotspot_limit)
+
 
 class MSI_Explorer(QWidget):
     """
@@ -43,6 +160,8 @@ class MSI_Explorer(QWidget):
         The window handling the exporting of metadata
     ms_object : Maldi_MS
         Maldi_MS object holding the metadata
+    metadata : dict
+        Metadata saved in the [MetadataWindow], None if not saved yet
     analysis_window : QWidget
         The window handling the analysis of selected regions of interest
 
@@ -65,18 +184,16 @@ class MSI_Explorer(QWidget):
         """
         super().__init__()
         self.viewer = napari_viewer
+        self.ms_object = None
+        self.metadata_window = None
+        self.metadata = None
+        # lay out all widgets in a single pass at the end of __init__
+        self.setUpdatesEnabled(False)
 
         ### QObjects
         
         # Logo
-        filename = "logo.png"
-        absolute_path = os.path.dirname(os.path.abspath(__file__))
-        relative_path = os.path.join("ressources/",filename)
-        path = os.path.join(absolute_path,relative_path)
-        image = cv2.imread(path)
-        rescaled_image = cv2.resize(image, (300, 300))
-        height, width, _ = rescaled_image.shape
-        logo = QPixmap(QImage(rescaled_image.data, width, height, 3* width, QImage.Format_BGR888))
+        logo = _get_logo()
 
         # Labels
         label_title = QLabel()
@@ -88,19 +205,15 @@ class MSI_Explorer(QWidget):
         self.label_reference = QLabel("Reference:")
 
         # Buttons
-        btn_load_imzml = QPushButton("Load imzML")
-        btn_load_imzml.setStyleSheet('''
-                                     QPushButton {
-                                         font-size: 20px;
-                                     }
-                                ''')
+        self.btn_load_imzml = QPushButton("Load imzML")
+        self.btn_load_imzml.setStyleSheet(LOAD_BUTTON_STYLE)
         self.btn_view_metadata = QPushButton("View Metadata")
         self.btn_execute_preprocessing = QPushButton("Execute")
         btn_minimize_preprocessing = QPushButton("-")
         self.btn_maximize_preprocessing = QPushButton("+")
 
         self.btn_view_metadata.clicked.connect(self.open_metadata)
-        btn_load_imzml.clicked.connect(self._open_file)
+        self.btn_load_imzml.clicked.connect(self._open_file)
         self.btn_execute_preprocessing.clicked.connect(self.preprocess)
         btn_minimize_preprocessing.clicked.connect(self._hide_preprocessing)
         self.btn_maximize_preprocessing.clicked.connect(
@@ -126,8 +239,14 @@ class MSI_Explorer(QWidget):
         self.lineedit_hotspot_removal.setText("99.99")
         self.lineedit_reference = QLineEdit()
         self.lineedit_reference.setPlaceholderText("M/Z")
-        self.lineedit_reference.hide()
-        self.label_reference.hide()
+
+        # label and lineedit of the reference are shown/hidden together
+        self.widget_reference = QWidget()
+        self.widget_reference.setLayout(QHBoxLayout())
+        self.widget_reference.layout().setContentsMargins(0, 0, 0, 0)
+        self.widget_reference.layout().addWidget(self.label_reference)
+        self.widget_reference.layout().addWidget(self.lineedit_reference)
+        self.widget_reference.hide()
 
         # QCheckBox
         self.checkbox_noise_reduction = QCheckBox("")
@@ -146,6 +265,7 @@ class MSI_Explorer(QWidget):
         preprocessing_layout.addWidget(label_hotspot_removal, 3, 0, 1, 1)
         preprocessing_layout.addWidget(self.lineedit_hotspot_removal, 3, 1, 1, 2)
         preprocessing_layout.addWidget(self.checkbox_hotspot_removal, 3, 3, 1, 1)
+        preprocessing_layout.addWidget(self.widget_reference, 4, 0, 1, 3)
         preprocessing_layout.addWidget(self.btn_execute_preprocessing, 10, 1, 1, 1)
         
         self.groupbox_preprocessing.setLayout(preprocessing_layout)
@@ -164,7 +284,7 @@ class MSI_Explorer(QWidget):
 
         top_buttons = QWidget()
         top_buttons.setLayout(QHBoxLayout())
-        top_buttons.layout().addWidget(btn_load_imzml)
+        top_buttons.layout().addWidget(self.btn_load_imzml)
         top_buttons.layout().addWidget(self.btn_view_metadata)
 
         widget.layout().addWidget(top_buttons)
@@ -184,45 +304,87 @@ class MSI_Explorer(QWidget):
 
         self.setLayout(QVBoxLayout())
         self.layout().addWidget(scroll_area)
+        self.setUpdatesEnabled(True)
+        self.updateGeometry()
 
         ### Create & float selection widget
+        # matplotlib is only imported once the widget is created
+        from ._selection import SelectionWindow
+
         self.selection_window = SelectionWindow(self)
         self.selection_window.show()
 
     # opens metadata window
+    @Slot()
     def open_metadata(self):
         """
         Opens a [MetadataWindow]
         """
-        if not hasattr(self, "ms_object"):
+        if self.ms_object is None:
             return
-        self.metadata_window = MetadataWindow(self.ms_object, self)
+        # only imported when the metadata are opened for the first time
+        from ._metadata import MetadataWindow
+
+        # the window is only rebuilt when another file has been loaded
+        window = self.metadata_window
+        if window is None or window.ms_object is not self.ms_object:
+            self.metadata_window = MetadataWindow(self.ms_object, self)
         self.metadata_window.show()
+        self.metadata_window.raise_()
+        self.metadata_window.activateWindow()
 
     # opens imzml file
+    @Slot()
     def _open_file(self):
         """
         Opens dialog for user to choose a file, passes data to selection_window
         """
         filepath = open_dialog(self, "*.imzML *.imzml")
-        QApplication.setOverrideCursor(Qt.WaitCursor)
-        file_reader = napari_get_reader(filepath)
-
-        try:
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                self.ms_object = file_reader(filepath)
-        except TypeError:
-            QApplication.restoreOverrideCursor()
+        if not filepath:
+            # dialog cancelled
             return
-        except UnboundLocalError:
-            msg = QMessageBox()
-            msg.setWindowTitle("Error")
-            msg.setText(".ibd file not found in same directory")
-            QApplication.restoreOverrideCursor()
-            msg.exec()
+        file_reader = napari_get_reader(filepath)
+        if file_reader is None:
+            # No imzML file chosen
             return
-        
+
+        # the file is read in the background, the UI stays responsive
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        self.btn_load_imzml.setEnabled(False)
+        worker = _read_file(file_reader, filepath)
+        worker.returned.connect(self._display_file)
+        worker.errored.connect(self._file_error)
+        worker.finished.connect(lambda: self.btn_load_imzml.setEnabled(True))
+        worker.start()
+
+    def _file_error(self, error):
+        """
+        Handles an error while reading a file
+
+        Parameters
+        ----------
+        error : Exception
+            The error raised by the reader
+        """
+        QApplication.restoreOverrideCursor()
+        if isinstance(error, UnboundLocalError):
+            self._show_error(".ibd file not found in same directory")
+        else:
+            # an exception raised in a slot would abort the application
+            self._show_error(f"The file could not be read: {error!r}")
+
+    def _display_file(self, result):
+        """
+        Passes the data of a read file to selection_window
+
+        Parameters
+        ----------
+        result : tuple
+            Maldi_MS object holding the data of the file and the (m/z,
+            tolerance) of its first ion image, see _read_file
+        """
+        self.ms_object, ion_range = result
+
         # check if data is in centroid mode
         if not self.ms_object.check_centroid():
             QApplication.restoreOverrideCursor()
@@ -234,21 +396,25 @@ class MSI_Explorer(QWidget):
             msg.addButton(QMessageBox.No)
             if msg.exec() == 16384:
                 self.ms_object.centroid_data()
+                # other spectra, the precalculated ion image is gone
+                ion_range = None
                 
             #16384 for yes, 65536 for no
             
 
         # Take spectrum from the center as a default spectrum
-        x = int(self.ms_object.get_metadata()["max count x"] / 2)
-        y = int(self.ms_object.get_metadata()["max count y"] / 2)
-        index = self.ms_object.get_index(y, x)
+        index = _center_index(self.ms_object)
+        x, y, _ = self.ms_object.get_coordinates(index)
         title = f"Original {(x,y)}, #{index}"
         self.selection_window.set_data(
             self.ms_object, self.ms_object.get_spectrum(index)
         )
         self.selection_window.plot_spectrum(title=title)
         try:
-            self.selection_window.display_image_from_plot()
+            if ion_range is None:
+                self.selection_window.display_image_from_plot()
+            else:
+                self.selection_window.display_image(*ion_range)
         except RuntimeError:
             msg = QMessageBox()
             msg.setWindowTitle("Metadata Error")
@@ -272,66 +438,134 @@ class MSI_Explorer(QWidget):
         self.selection_window.btn_export_spectrum_plot.setEnabled(True)
         QApplication.restoreOverrideCursor()
 
+    @Slot()
     def preprocess(self):
-        QApplication.setOverrideCursor(Qt.WaitCursor)
+        """
+        Checks the preprocessing settings, then runs the preprocessing steps
+        in a background thread
+        """
+        noise_limit = None
         if self.checkbox_noise_reduction.isChecked():
-            try:
-                filter_limit = float(self.lineedit_noise_reduction.text())
-            except ValueError:
-                msg = QMessageBox()
-                msg.setWindowTitle("Error")
-                msg.setText("Noise reduction value is not a number")
-                msg.exec()
+            noise_limit = self._read_percentage(
+                self.lineedit_noise_reduction, "Noise reduction"
+            )
+            if noise_limit is None:
                 return
-            if filter_limit < 0 or filter_limit > 100:
-                msg = QMessageBox()
-                msg.setWindowTitle("Error")
-                msg.setText("Noise reduction value must be between 0 and 100")
-                msg.exec()
+        hotspot_limit = None
+        if self.checkbox_hotspot_removal.isChecked():
+            hotspot_limit = self._read_percentage(
+                self.lineedit_hotspot_removal, "Hotspot removal"
+            )
+            if hotspot_limit is None:
                 return
-            self.ms_object.noise_reduction(filter_limit)
         normalization_method = self.combobox_scale.currentText()
+        mz = None
         if self.lineedit_reference.text() != "":
-            mz = float(self.lineedit_reference.text())
-            self.ms_object.normalize(normalization_method, mz)
-        else:
-            self.ms_object.normalize(normalization_method)
-        if self.checkbox_hotspot_removal.isChecked():
             try:
-                filter_limit = float(self.lineedit_hotspot_removal.text())
+                mz = float(self.lineedit_reference.text())
             except ValueError:
-                msg = QMessageBox()
-                msg.setWindowTitle("Error")
-                msg.setText("Hotspot removal value is not a number")
-                msg.exec()
-                return
-            if filter_limit < 0 or filter_limit > 100:
-                msg = QMessageBox()
-                msg.setWindowTitle("Error")
-                msg.setText("Hotspot removal value must be between 0 and 100")
-                msg.exec()
+                self._show_error("Reference value is not a number")
                 return
-            self.ms_object.remove_hotspots(filter_limit)
+
+        # the spectra must not be read while they are changed
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        self._set_preprocessing(True)
+        worker = _preprocess(
+            self.ms_object, noise_limit, normalization_method, mz, hotspot_limit
+        )
+        worker.errored.connect(
+            lambda error: self._show_error(f"Preprocessing failed: {error!r}")
+        )
+        worker.finished.connect(self._preprocessing_finished)
+        worker.start()
+
+    def _preprocessing_finished(self):
+        """
+        Restores the UI after the preprocessing
+        """
         QApplication.restoreOverrideCursor()
+        self._set_preprocessing(False)
+        # the spectra have changed, the same m/z gives a new image and the
+        # mean spectra are calculated again
+        self.selection_window.invalidate_image()
+        self.selection_window.mean_spectra.clear()
+
+    def _set_preprocessing(self, running):
+        """
+        Disables everything that reads the spectra or replaces the data while
+        the preprocessing runs
+
+        Parameters
+        ----------
+        running : bool
+            True while the preprocessing runs
+        """
+        self.btn_execute_preprocessing.setEnabled(not running)
+        self.btn_load_imzml.setEnabled(not running)
+        self.btn_view_metadata.setEnabled(not running)
+        self.selection_window.set_busy(running)
 
+    def _read_percentage(self, lineedit, name):
+        """
+        Reads a percentage from a lineedit, shows an error if it is invalid
+
+        Parameters
+        ----------
+        lineedit : QLineEdit
+            The lineedit holding the percentage
+        name : str
+            Name of the preprocessing step for the error message
+
+        Returns
+        -------
+        float or None
+            The percentage, None if it is invalid
+        """
+        try:
+            percentage = float(lineedit.text())
+        except ValueError:
+            self._show_error(f"{name} value is not a number")
+            return None
+        if percentage < 0 or percentage > 100:
+            self._show_error(f"{name} value must be between 0 and 100")
+            return None
+        return percentage
+
+    def _show_error(self, text):
+        """
+        Shows an error message
+
+        Parameters
+        ----------
+        text : str
+            The error message
+        """
+        msg = QMessageBox()
+        msg.setWindowTitle("Error")
+        msg.setText(text)
+        msg.exec()
+
+    @Slot()
     def _hide_preprocessing(self):
         """
         Hides preprocessing steps
         """
+        # one layout pass for both changes
+        self.setUpdatesEnabled(False)
         self.btn_maximize_preprocessing.show()
         self.groupbox_preprocessing.hide()
+        self.setUpdatesEnabled(True)
 
+    @Slot()
     def _show_preprocessing(self):
         """
         Shows preprocessing steps
         """
+        self.setUpdatesEnabled(False)
         self.groupbox_preprocessing.show()
         self.btn_maximize_preprocessing.hide()
+        self.setUpdatesEnabled(True)
 
+    @Slot(str)
     def toggle_reference_selection(self, metric):
-        if metric == "peak":
-            self.label_reference.show()
-            self.lineedit_reference.show()
-        else:
-            self.label_reference.hide()
-            self.lineedit_reference.hide()
+        self.widget_reference.setVisible(metric == "peak")
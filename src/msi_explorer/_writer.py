@@ -1,7 +1,36 @@
 from __future__ import annotations
 import csv
+import os
 from qtpy.QtWidgets import QFileDialog, QMessageBox
 
+# buffer size for writing large files
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# the file dialogs don't ask the OS for custom folder icons, slow on
+# network drives
+DIALOG_OPTIONS = QFileDialog.DontUseCustomDirectoryIcons
+
+# header of a new database file, as written by csv.writer
+DATABASE_HEADER = "M/Z value,Name,Description\r\n"
+
+# The message box is created once and reused, it needs a QApplication
+_MESSAGE_BOX = None
+
+
+def _get_message_box():
+    """
+    Returns the shared message box, creates it on the first call
+
+    Returns
+    -------
+    QMessageBox
+        The shared message box
+    """
+    global _MESSAGE_BOX
+    if _MESSAGE_BOX is None:
+        _MESSAGE_BOX = QMessageBox()
+    return _MESSAGE_BOX
+
 
 def save_dialog(parent, filetype):
     """
@@ -19,8 +48,9 @@ def save_dialog(parent, filetype):
     str
         Path of the selected file
     """
-    dialog = QFileDialog()
-    filepath = dialog.getSaveFileName(parent, filter=filetype)
+    filepath, _ = QFileDialog.getSaveFileName(
+        parent, filter=filetype, options=DIALOG_OPTIONS
+    )
     return filepath
 
 
@@ -35,11 +65,10 @@ def write_metadata(path, data):
     data : list
         Metadata to be saved
     """
-    file = open(path, "w", newline="")
-    writer = csv.writer(file)
-    for line in data:
-        writer.writerow(line)
-    file.close()
+    # a large buffer keeps the number of write calls low on network drives
+    with open(path, "w", newline="", buffering=WRITE_BUFFER_SIZE) as file:
+        writer = csv.writer(file)
+        writer.writerows(data)
 
 
 def create_new_database(path):
@@ -51,11 +80,12 @@ def create_new_database(path):
     path : str
         Path to write the new database to
     """
-    file = open(path + "NewDatabase.csv", "w", newline="\n")
-    writer = csv.writer(file)
-    writer.writerow(["M/Z value", "Name", "Description"])
-    file.close()
-    msg = QMessageBox()
+    # the header is known, no csv writer needed (same \r\n line end)
+    with open(
+        os.path.join(path, "NewDatabase.csv"), "w", newline="\n"
+    ) as file:
+        file.write(DATABASE_HEADER)
+    msg = _get_message_box()
     msg.setWindowTitle("New Database created")
     msg.setText("New csv file has been created")
     msg.exec()
@@ -66,8 +96,9 @@ def write_file(path, data, append=False, newline=True):
         mode = "a"
     else:
         mode = "w"
-    f = open(path, mode)
-    f.write(f"{data}")
-    if newline:
-        f.write("\n")
-    f.close()
+    if not isinstance(data, str):
+        data = f"{data}"
+    with open(path, mode) as f:
+        f.write(data)
+        if newline:
+            f.write("\n")